@@ -27,10 +27,33 @@ import argparse
 import csv
 import sfle
 import sys
+import tempfile
+
+def _profile( astrData ):
+	"""
+	Classifies and summarizes one row's data values, parsing numeric rows with a single
+	vectorized float conversion and falling back to a categorical summary on failure.
+	Returns the row's type, missing count, sum or number of values, and maximum.
+
+	>>> _profile( ["1", "", "2.5"] )
+	('numeric', 1, '3.5', 2.5)
+	>>> _profile( ["a", "b", " ", "a"] )
+	('categorical', 1, 3, None)
+	"""
+
+	astrValues = filter( None, astrData )
+	try:
+		adData = map( float, astrValues )
+		# Parsed values are never blank, so only empty cells are missing
+		return ("numeric", len( astrData ) - len( astrValues ), "%g" % sum( adData ), max( adData ))
+	except ValueError:
+		return ("categorical", sum( 1 for s in astrData if not s.strip( ) ), len( set(astrData) ), None)
 
 def report( aastrLines, ostm ):
 	"""
-	Outputs simple statistics in RST format for each row of a data table.
+	Outputs simple statistics in RST format for each row of a data table.  Profiled rows
+	are spooled to a temporary file while the table width is measured, so memory use does
+	not grow with the number of rows.
 	
 	:param	aastrLines:	Split lines from which data are read.
 	:type	aastrLines:	collection of string collections
@@ -41,28 +64,25 @@ def report( aastrLines, ostm ):
 	sfle.rst_section( "Report", ostm )
 	sfle.rst_text( "The following is a table describing your data.", ostm )
 	
-	aaTable = []
+	fileTable = tempfile.TemporaryFile( )
+	csvw = csv.writer( fileTable, csv.excel_tab )
+	iWidth = 0
 	fFirst = True
 	dMax = None
 	for astrLine in aastrLines:
-		strID, astrData = astrLine[0], astrLine[1:]
 		if fFirst:
 			fFirst = False
-			aaTable.append( ["Row", "Type", "# Missing", "Sum or # Values"] )
+			aRow = ["Row", "Type", "# Missing", "Sum or # Values"]
 		else:
-			try:
-				adData = [float(s) for s in filter( None, astrData )]
-				dCur = max( adData )
-				if ( dMax == None ) or ( dCur > dMax ):
-					dMax = dCur
-				strInfo = "%g" % sum( adData )
-				strType = "numeric"
-			except ValueError:
-				strInfo = len( set(astrData) )
-				strType = "categorical"
-			aaTable.append( [strID, strType, len( filter( lambda s: not s.strip( ), astrData ) ),
-				strInfo] )
-	sfle.rst_table( aaTable, ostm )
+			strType, iMissing, strInfo, dCur = _profile( astrLine[1:] )
+			if ( dCur != None ) and ( ( dMax == None ) or ( dCur > dMax ) ):
+				dMax = dCur
+			aRow = [astrLine[0], strType, iMissing, strInfo]
+		iWidth = max( iWidth, max( len( str(p) ) for p in aRow ) )
+		csvw.writerow( aRow )
+	fileTable.seek( 0 )
+	sfle.rst_table( csv.reader( fileTable, csv.excel_tab ), ostm, True, iWidth )
+	fileTable.close( )
 
 	sfle.rst_subsection( "Maximum", ostm )
 	sfle.rst_text( "The maximum value was: %g" % dMax, ostm )
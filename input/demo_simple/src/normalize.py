@@ -58,11 +58,74 @@ Examples
 
 import argparse
 import csv
+import os
+import stat
 import sys
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def _parse( astrData ):
+	"""
+	Converts non-blank data values to floats and blank values to None.
+	"""
+
+	return [( float(s) if s.strip( ) else None ) for s in astrData]
+
+def _sums( aadData, iCols ):
+	"""
+	Accumulates the sums of the first iCols columns of parsed data rows in one pass.
+
+	>>> _sums( [[1.0, None, 2.0], [3.0, 4.0]], 2 )
+	[4.0, 4.0]
+	"""
+
+	adRet = [0.0] * iCols
+	for adData in aadData:
+		for iCol in range( min( iCols, len( adData ) ) ):
+			if adData[iCol]:
+				adRet[iCol] += adData[iCol]
+	return adRet
+
+def _scale( adData, adSums ):
+	"""
+	Divides each nonzero value of a parsed data row by its column's nonzero sum, in place.
+	"""
+
+	for iCol in range( min( len( adSums ), len( adData ) ) ):
+		if adData[iCol] and adSums[iCol]:
+			adData[iCol] /= adSums[iCol]
+	return adData
+
+def _normalize_numpy( aadData, iCols ):
+	"""
+	Normalizes rectangular parsed data with NumPy, returning rows identical to the pure Python result,
+	or None if any value is infinite or NaN, which only the pure Python path handles.
+	
+	Column sums are taken with a cumulative sum, which adds values in row order and so
+	reproduces the sequential floating point result exactly.
+
+	>>> _normalize_numpy( [[1.0, None], [3.0, 2.0]], 2 )
+	[[0.25, None], [0.75, 1.0]]
+	>>> _normalize_numpy( [[1.0, float("inf")], [3.0, 2.0]], 2 )
+	"""
+
+	afMissing = numpy.array( [[( d == None ) for d in a] for a in aadData], dtype = bool )
+	adData = numpy.array( [[( numpy.nan if ( d == None ) else d ) for d in a] for a in aadData], dtype = float )
+	if not numpy.isfinite( adData[~afMissing] ).all( ):
+		return None
+	adValues = numpy.where( afMissing[:, :iCols], 0, adData[:, :iCols] )
+	adSums = numpy.cumsum( adValues, axis = 0 )[-1]
+	afScale = ( adValues != 0 ) & ( adSums != 0 )
+	adData[:, :iCols] = numpy.where( afScale, adValues / numpy.where( adSums != 0, adSums, 1 ), adData[:, :iCols] )
+	return [[( None if ( d != d ) else d ) for d in a] for a in adData.tolist( )]
+
 def normalize( aastrIn, ostm ):
 	"""
-	Normalizes the column sums of the input tab-delimited rows to 1. 
+	Normalizes the column sums of the input tab-delimited rows to 1, holding them in memory.
+	Rectangular, finite data are normalized with NumPy when it is available.
 	
 	:param	aastrIn:	Split lines from which data are read.
 	:type	aastrIn:	collection of string collections
@@ -90,23 +153,69 @@ def normalize( aastrIn, ostm ):
 		if astrHeaders:
 			strID, astrData = astrLine[0], astrLine[1:]
 			astrIDs.append( strID )
-			aadData.append( [( float(s) if s.strip( ) else None ) for s in astrData] )
+			aadData.append( _parse( astrData ) )
 		else:
 			astrHeaders = astrLine
 
-	for iCol in range( len( astrHeaders ) - 1 ):
-		dSum = sum( filter( None, (a[iCol] for a in aadData) ) )
-		if not dSum:
-			continue
+	iCols = max( 0, len( astrHeaders ) - 1 )
+	# Vectorize only rectangular data; ragged rows and infinite or NaN values keep the row-by-row path
+	aadNumpy = _normalize_numpy( aadData, iCols ) if ( numpy and aadData and
+		all( ( len( a ) == iCols ) for a in aadData ) ) else None
+	if aadNumpy != None:
+		aadData = aadNumpy
+	else:
+		adSums = _sums( aadData, iCols )
 		for adData in aadData:
-			if adData[iCol]:
-				adData[iCol] /= dSum
+			_scale( adData, adSums )
 
 	csvw = csv.writer( ostm, csv.excel_tab )
 	csvw.writerow( astrHeaders )
 	for strID, adData in zip( astrIDs, aadData ):
 		csvw.writerow( [strID] + adData )
 
+def normalize_file( fileIn, ostm ):
+	"""
+	Normalizes the column sums of a seekable tab-delimited file to 1 in two streaming
+	passes: the first accumulates column sums and the second re-reads the file and
+	writes each scaled row, so memory use does not grow with the number of rows.
+	Reading starts at the stream's current position, to which the second pass returns.
+	Output is identical to that of :py:func:`normalize`.
+	
+	:param	fileIn:	Seekable input stream from which data are read.
+	:type	fileIn:	input stream
+	:param	ostm:	Output stream to which normalized columns are written.
+	:type	ostm:	output stream
+
+	>>> import StringIO
+	>>> normalize_file( StringIO.StringIO( "tid\\texp1\\texp2\\ngene1\\t1\\t\\ngene2\\t3\\t0\\n" ), sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	tid	exp1	exp2
+	gene1	0.25	
+	gene2	0.75	0.0
+
+	>>> fileIn = StringIO.StringIO( "skipped\\ntid\\texp1\\ngene1\\t1\\ngene2\\t3\\n" )
+	>>> fileIn.readline( )
+	'skipped\\n'
+	>>> normalize_file( fileIn, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	tid	exp1
+	gene1	0.25
+	gene2	0.75
+	"""
+
+	iStart = fileIn.tell( )
+	csvr = csv.reader( fileIn, csv.excel_tab )
+	astrHeaders = next( csvr, None )
+	if not astrHeaders:
+		return
+	iCols = len( astrHeaders ) - 1
+	adSums = _sums( ( _parse( astrLine[1:] ) for astrLine in csvr ), iCols )
+
+	fileIn.seek( iStart )
+	csvr = csv.reader( fileIn, csv.excel_tab )
+	csvw = csv.writer( ostm, csv.excel_tab )
+	csvw.writerow( next( csvr ) )
+	for astrLine in csvr:
+		csvw.writerow( [astrLine[0]] + _scale( _parse( astrLine[1:] ), adSums ) )
+
 argp = argparse.ArgumentParser( prog = "normalize.py",
 	description = """Normalizes the column sums of a tab-delimited numerical matrix to 1.
 
@@ -115,7 +224,10 @@ __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	normalize( csv.reader( sys.stdin, csv.excel_tab ), sys.stdout )
+	if stat.S_ISREG( os.fstat( sys.stdin.fileno( ) ).st_mode ):
+		normalize_file( sys.stdin, sys.stdout )
+	else:
+		normalize( csv.reader( sys.stdin, csv.excel_tab ), sys.stdout )
 
 if __name__ == "__main__":
 	_main( )
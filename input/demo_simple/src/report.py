@@ -27,31 +27,49 @@ import argparse
 import csv
 import sys
 
+def _profile( astrData ):
+	"""
+	Classifies and summarizes one row's data values, parsing numeric rows in one map( float )
+	pass over the non-empty cells and falling back to a categorical summary on failure.
+
+	>>> _profile( ["1", "", "2.5"] )
+	('numeric', 1, '3.5')
+	>>> _profile( ["a", "b", " ", "a"] )
+	('categorical', 1, 3)
+	"""
+
+	astrValues = filter( None, astrData )
+	try:
+		# Parsed values are never blank, so only empty cells are missing
+		return ("numeric", len( astrData ) - len( astrValues ), "%g" % sum( map( float, astrValues ) ))
+	except ValueError:
+		return ("categorical", sum( 1 for s in astrData if not s.strip( ) ), len( set(astrData) ))
+
 def report( aastrLines, ostm ):
 	"""
-	Outputs simple statistics for each row of a data table.
+	Outputs simple statistics for each row of a data table, streaming one output row per
+	input row in constant memory.
 	
 	:param	aastrLines:	Split lines from which data are read.
 	:type	aastrLines:	collection of string collections
 	:param	ostm:		Output stream to which report is written.
 	:type	ostm:		output stream
+
+	>>> report( [["tid", "exp1", "exp2"], ["gene1", "1", ""], ["gene2", "x", "y"]], sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	row	type	#missing	sum or #values
+	gene1	numeric	1	1
+	gene2	categorical	0	2
 	"""
 
 	csvw = csv.writer( ostm, csv.excel_tab )
 	fFirst = True
 	for astrLine in aastrLines:
-		strID, astrData = astrLine[0], astrLine[1:]
 		if fFirst:
 			fFirst = False
 			csvw.writerow( ("row", "type", "#missing", "sum or #values") )
 		else:
-			try:
-				strInfo = "%g" % sum( float(s) for s in filter( None, astrData ) )
-				strType = "numeric"
-			except ValueError:
-				strInfo = len( set(astrData) )
-				strType = "categorical"
-			csvw.writerow( (strID, strType, len( filter( lambda s: not s.strip( ), astrData ) ), strInfo) )
+			strType, iMissing, strInfo = _profile( astrLine[1:] )
+			csvw.writerow( (astrLine[0], strType, iMissing, strInfo) )
 
 argp = argparse.ArgumentParser( prog = "report.py",
 	description = """A simple demonstration script that reports on each row of a tab-delimited text file.""" )
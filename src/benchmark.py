@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#######################################################################################
+# This file is provided under the Creative Commons Attribution 3.0 license.
+#
+# You are free to share, copy, distribute, transmit, or adapt this work
+# PROVIDED THAT you attribute the work to the authors listed below.
+# For more information, please see the following web page:
+# http://creativecommons.org/licenses/by/3.0/
+#
+# This file is a component of the SflE Scientific workFLow Environment for reproducible 
+# research, authored by the Huttenhower lab at the Harvard School of Public Health
+# (contact Curtis Huttenhower, chuttenh@hsph.harvard.edu).
+#
+# If you use this environment, the included scripts, or any related code in your work,
+# please let us know, sign up for the SflE user's group (sfle-users@googlegroups.com),
+# pass along any issues or feedback, and we'll let you know as soon as a formal citation
+# is available.
+#######################################################################################
+
+
+"""
+Examples
+~~~~~~~~
+
+``Examples``::
+
+	$ benchmark.py vitals -r 300000 -c 50 -j 1,2 -n 1
+	jobs	wall	cpu	MB/s	speedup
+	1	2.34	2.31	49.41	1.00
+	2	2.91	2.80	39.67	0.80
+
+	$ git show <earlier commit>:src/merge_tables.py > /tmp/merge_tables.py
+	$ benchmark.py merge_tables -r 10000 -c 2000 -j 1 -n 1 -a-t -b /tmp/merge_tables.py
+	jobs	wall	cpu	MB/s	speedup
+	base	20.10	19.87	14.98	1.00
+	1	1.77	1.75	170.06	11.35
+
+Timings depend on the machine; the above are from a single core, where no speedup is possible.
+
+.. testsetup::
+
+	from benchmark import *
+"""
+
+import argparse
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate_random_table
+
+c_strDirSrc	= os.path.dirname( os.path.abspath( __file__ ) )
+"""Directory holding the scripts being benchmarked."""
+c_hashTables	= {"vitals" : 1, "merge_tables" : 2}
+"""Number of tables each script reads; one goes to standard input, more are named as arguments."""
+
+def _table( iRows, iCols, iSeed, iStream = 0 ):
+	"""
+	Writes a random numeric table to a temporary file and returns its path.  Tables from
+	different streams hold different values under distinct row IDs.
+	"""
+
+	iFile, strRet = tempfile.mkstemp( suffix = ".pcl" )
+	with os.fdopen( iFile, "w" ) as fileOut:
+		generate_random_table.generate_random_table( iRows, iCols, 0, 1 + ( iStream * iRows ), 1000, fileOut, iSeed, iStream )
+	return strRet
+
+def _time( astrCmd, astrIn ):
+	"""
+	Runs a command on one file as standard input or several as arguments, discarding its
+	output, and returns its wall clock and child CPU seconds.
+	"""
+
+	if len( astrIn ) > 1:
+		astrCmd = astrCmd + astrIn
+	pBefore = resource.getrusage( resource.RUSAGE_CHILDREN )
+	dBegin = time.time( )
+	with open( astrIn[0] ) as fileIn:
+		with open( os.devnull, "w" ) as fileOut:
+			if subprocess.call( astrCmd, stdin = fileIn, stdout = fileOut ):
+				raise RuntimeError( "benchmark command failed: %s" % " ".join( astrCmd ) )
+	dWall = time.time( ) - dBegin
+	pAfter = resource.getrusage( resource.RUSAGE_CHILDREN )
+	return (dWall, ( pAfter.ru_utime + pAfter.ru_stime ) - ( pBefore.ru_utime + pBefore.ru_stime ))
+
+def benchmark( astrCmd, astrIn, aiJobs, iRepeats, ostm, astrBaseline = None ):
+	"""
+	Times a command with each -j job count over the same inputs, keeping the fastest of
+	several runs, and outputs wall clock time, CPU time, throughput, and speedup over the
+	baseline command if given or else over the first count.
+
+	:param	astrCmd:	Command to which -j and a job count are appended.
+	:type	astrCmd:	list of strings
+	:param	astrIn:		Input file given to the command on standard input, or several given as arguments.
+	:type	astrIn:		list of strings
+	:param	aiJobs:		Job counts to time.
+	:type	aiJobs:		list of ints
+	:param	iRepeats:	Number of runs per job count.
+	:type	iRepeats:	int
+	:param	ostm:		Output stream to which timings are written.
+	:type	ostm:		output stream
+	:param	astrBaseline:	Command, e.g. an earlier version of the script, timed once per run with no job count.
+	:type	astrBaseline:	list of strings
+	"""
+
+	dMB = sum( os.path.getsize( s ) for s in astrIn ) / float(1 << 20)
+	csvw = csv.writer( ostm, csv.excel_tab )
+	csvw.writerow( ("jobs", "wall", "cpu", "MB/s", "speedup") )
+	dFirst = None
+	for strJobs, astrCur in ( [("base", astrBaseline)] if astrBaseline else [] ) + \
+		[(str(i), astrCmd + ["-j", str(i)]) for i in aiJobs]:
+		dWall, dCPU = min( _time( astrCur, astrIn ) for i in range( iRepeats ) )
+		dFirst = dFirst or dWall
+		csvw.writerow( [strJobs] + ["%.2f" % d for d in (dWall, dCPU, dMB / dWall, dFirst / dWall)] )
+		ostm.flush( )
+
+argp = argparse.ArgumentParser( prog = "benchmark.py",
+	description = """Times a table script on generated random tables at several job counts.
+
+Use this to check that parallel modes scale with the number of cores available, or with -b
+that a change to a script speeds it up.""" )
+argp.add_argument( "strScript",		metavar = "script",
+	choices = sorted( c_hashTables ),
+	help = "Script to benchmark" )
+argp.add_argument( "-r",		dest = "iRows",		metavar = "rows",
+	type = int,		default = 300000,
+	help = "Number of rows in the generated table" )
+argp.add_argument( "-c",		dest = "iCols",		metavar = "columns",
+	type = int,		default = 50,
+	help = "Number of columns in the generated table" )
+argp.add_argument( "-j",		dest = "strJobs",	metavar = "jobs",
+	default = "1,2,4,8",
+	help = "Comma-separated job counts to time" )
+argp.add_argument( "-n",		dest = "iRepeats",	metavar = "repeats",
+	type = int,		default = 3,
+	help = "Runs per job count, of which the fastest is reported" )
+argp.add_argument( "-s",		dest = "iSeed",		metavar = "seed",
+	type = int,		default = 1,
+	help = "Seed for the generated table" )
+argp.add_argument( "-a",		dest = "astrArgs",	metavar = "argument",
+	action = "append",	default = [],
+	help = "Extra argument passed to the script; may be repeated" )
+argp.add_argument( "-b",		dest = "strBaseline",	metavar = "script.py",
+	help = "Another version of the script to time first, against which speedups are reported" )
+__doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
+
+def _main( ):
+	args = argp.parse_args( )
+	astrIn = [_table( args.iRows, args.iCols, args.iSeed, i ) for i in range( c_hashTables[args.strScript] )]
+	try:
+		benchmark( [sys.executable, os.path.join( c_strDirSrc, args.strScript + ".py" )] + args.astrArgs,
+			astrIn, [int(s) for s in args.strJobs.split( "," )], args.iRepeats, sys.stdout,
+			( [sys.executable, args.strBaseline] + args.astrArgs ) if args.strBaseline else None )
+	finally:
+		for strIn in astrIn:
+			os.unlink( strIn )
+
+if __name__ == "__main__":
+	_main( )
@@ -52,13 +52,207 @@ Examples
 
 import argparse
 import csv
+import multiprocessing
+import os
+import math
 import random
 import sys
 
-def generate_random_table( iRows, iCols, dMissing, iFirst, dMax, ostm ):
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+c_iBlock	= 1 << 18
+"""Approximate number of cells generated, formatted, and written at a time."""
+
+def _generator( iSeed, iStream ):
+	"""
+	Returns an independent random number generator for one output stream, seeded reproducibly if iSeed is given.
+	"""
+
+	if numpy:
+		return numpy.random.RandomState( None if ( iSeed == None ) else [iSeed, iStream] )
+	return random.Random( None if ( iSeed == None ) else ( ( iSeed << 32 ) + iStream ) )
+
+def _random( pRandom ):
+	"""
+	Draws one uniform value in [0, 1) from either a NumPy or a standard random number generator.
+	"""
+
+	return ( pRandom.random_sample( ) if numpy else pRandom.random( ) )
+
+def _poisson( pRandom, dLambda ):
+	"""
+	Draws a Poisson variate without NumPy: exactly by multiplication of uniforms for small
+	means, and by a rounded normal approximation for large ones.
+	"""
+
+	if dLambda > 30:
+		return max( 0, int( round( pRandom.gauss( dLambda, dLambda ** 0.5 ) ) ) )
+	dLimit, dProduct, iRet = math.exp( -dLambda ), pRandom.random( ), 0
+	while dProduct > dLimit:
+		dProduct *= pRandom.random( )
+		iRet += 1
+	return iRet
+
+class CProfile:
+	"""
+	Describes the distribution and structure of generated table contents.
+	
+	Values follow one of ``c_astrDistributions``: ``uniform`` in [0, max), ``nbinom``
+	negative binomial counts with mean max and size (inverse dispersion) shape, or
+	``lognormal`` abundances with median max and log-scale standard deviation shape.
+	A fraction of values can be replaced by structural zeros, rows can be truncated
+	to skewed lengths (each keeps ``1 + int( columns * u**ragged )`` values for uniform
+	*u*, capped at the number of columns), a fraction of row IDs can repeat earlier
+	IDs of the same block, and rows can be shuffled within each block so that IDs
+	are unsorted.
+	
+	>>> pProfile = CProfile( "nbinom", 1, 0.5, 0, 0.5 )
+	>>> [list(a) for a in pProfile.values( _generator( 1, 0 ), 2, 3, 0 )]
+	[[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]
+	>>> pProfile.format( ) % 12345678
+	'\\t12345678'
+	>>> pProfile.ids( _generator( 1, 0 ), 2, 5 )[0]
+	5
+	"""
+
+	c_astrDistributions	= ("uniform", "nbinom", "lognormal")
+
+	def __init__( self, strDistribution = "uniform", dShape = 1, dZeros = 0, dRagged = 0, dDuplicates = 0, fUnsorted = False ):
+
+		if strDistribution not in CProfile.c_astrDistributions:
+			raise ValueError( "Unknown distribution: %s" % strDistribution )
+		self.m_strDistribution = strDistribution
+		self.m_dShape = dShape
+		self.m_dZeros = dZeros
+		self.m_dRagged = dRagged
+		self.m_dDuplicates = dDuplicates
+		self.m_fUnsorted = fUnsorted
+
+	def format( self ):
+		"""Returns the format of one tab-prefixed output value."""
+
+		return ( "\t%.15g" if ( self.m_strDistribution == "nbinom" ) else "\t%g" )
+
+	def values( self, pRandom, iRows, iCols, dMax ):
+		"""
+		Returns an iRows by iCols NumPy array (or list of lists) of values drawn from pRandom.
+		"""
+
+		if dMax <= 0:
+			adRet = numpy.zeros( (iRows, iCols) ) if numpy else [[0.0] * iCols for i in range( iRows )]
+		elif numpy:
+			if self.m_strDistribution == "nbinom":
+				adRet = pRandom.negative_binomial( self.m_dShape, self.m_dShape / float(self.m_dShape + dMax),
+					(iRows, iCols) ).astype( float )
+			elif self.m_strDistribution == "lognormal":
+				adRet = pRandom.lognormal( math.log( dMax ), self.m_dShape, (iRows, iCols) )
+			else:
+				adRet = pRandom.random_sample( (iRows, iCols) ) * dMax
+		else:
+			if self.m_strDistribution == "nbinom":
+				funcValue = lambda: float(_poisson( pRandom, pRandom.gammavariate( self.m_dShape, dMax / float(self.m_dShape) ) ))
+			elif self.m_strDistribution == "lognormal":
+				funcValue = lambda: pRandom.lognormvariate( math.log( dMax ), self.m_dShape )
+			else:
+				funcValue = lambda: dMax * pRandom.random( )
+			adRet = [[funcValue( ) for i in range( iCols )] for j in range( iRows )]
+		if self.m_dZeros:
+			if numpy:
+				adRet[pRandom.random_sample( (iRows, iCols) ) < self.m_dZeros] = 0
+			else:
+				for adRow in adRet:
+					for i in range( iCols ):
+						if pRandom.random( ) < self.m_dZeros:
+							adRow[i] = 0.0
+		return adRet
+
+	def ids( self, pRandom, iRows, iFirst ):
+		"""
+		Returns the row IDs of a block, with the requested fraction repeating earlier IDs of the block.
+		"""
+
+		aiRet = range( iFirst, iFirst + iRows )
+		if self.m_dDuplicates:
+			for i in range( 1, iRows ):
+				if _random( pRandom ) < self.m_dDuplicates:
+					aiRet[i] = aiRet[int( _random( pRandom ) * i )]
+		return aiRet
+
+	def lengths( self, pRandom, iRows, iCols ):
+		"""
+		Returns the number of values kept in each row of a block.
+		"""
+
+		if not self.m_dRagged:
+			return [iCols] * iRows
+		return [min( iCols, 1 + int( iCols * ( _random( pRandom ) ** self.m_dRagged ) ) ) for i in range( iRows )]
+
+def _block_rows( iCols ):
+	"""
+	Returns the number of rows generated at a time in a table of iCols columns.
+	"""
+
+	return max( 1, c_iBlock / max( 1, iCols ) )
+
+def _block( pRandom, iRows, iCols, dMissing, iFirst, dMax, pProfile ):
+	"""
+	Returns a block of formatted table rows with IDs starting at iFirst.
+	
+	Values (NaN where missing) are drawn in bulk, rows are truncated to their lengths
+	by keeping only their leading cells, every kept cell of the block is then formatted
+	by a single string formatting operation over a format string joined from
+	pre-built row formats, and missing cells are blanked.
+	"""
+
+	adValues = pProfile.values( pRandom, iRows, iCols, dMax )
+	if numpy:
+		if dMissing:
+			adValues[pRandom.random_sample( (iRows, iCols) ) <= dMissing] = numpy.nan
+		aiIDs = numpy.array( pProfile.ids( pRandom, iRows, iFirst ), dtype = float )
+		if pProfile.m_fUnsorted:
+			aiOrder = pRandom.permutation( iRows )
+			aiIDs, adValues = aiIDs[aiOrder], adValues[aiOrder]
+		adCells = numpy.hstack( (aiIDs[:, None], adValues) )
+	else:
+		if dMissing:
+			for adRow in adValues:
+				for i in range( iCols ):
+					if pRandom.random( ) <= dMissing:
+						adRow[i] = float("nan")
+		aiIDs = pProfile.ids( pRandom, iRows, iFirst )
+		aiOrder = range( iRows )
+		if pProfile.m_fUnsorted:
+			pRandom.shuffle( aiOrder )
+		adCells = [[aiIDs[i]] + adValues[i] for i in aiOrder]
+	funcRow = lambda iLength: "R%06d" + ( pProfile.format( ) * iLength ) + "\r\n"
+	if pProfile.m_dRagged:
+		aiLengths = pProfile.lengths( pRandom, iRows, iCols )
+		hashRows = dict( (i, funcRow( i )) for i in set( aiLengths ) )
+		strFormat = "".join( hashRows[i] for i in aiLengths )
+		if numpy:
+			adCells = adCells[numpy.arange( iCols + 1 )[None, :] <= numpy.array( aiLengths )[:, None]].tolist( )
+		else:
+			adCells = [d for i in range( iRows ) for d in adCells[i][:( aiLengths[i] + 1 )]]
+	else:
+		strFormat = funcRow( iCols ) * iRows
+		adCells = adCells.ravel( ).tolist( ) if numpy else [d for adRow in adCells for d in adRow]
+	strRet = strFormat % tuple(adCells)
+	if dMissing:
+		strRet = strRet.replace( "\tnan", "\t" )
+	return strRet
+
+def generate_random_table( iRows, iCols, dMissing, iFirst, dMax, ostm, iSeed = None, iStream = 0, pProfile = None ):
 	"""
 	Creates a random tab-delimited table of floating point values between 0 and 1.
 	
+	Values and missingness are generated and formatted in blocks of roughly
+	``c_iBlock`` cells, using NumPy when it is available.  Each block draws from its
+	own random stream, numbered on from iStream, so that a table can be generated in
+	parts starting at block boundaries (see :py:func:`generate_random_shards`).
+	
 	:param	iRows:		Number of output rows.
 	:type	iRows:		int
 	:param	iCols:		Number of output columns.
@@ -71,6 +265,12 @@ def generate_random_table( iRows, iCols, dMissing, iFirst, dMax, ostm ):
 	:type	dMax:		float
 	:param	ostm:		Output stream to which table is written.
 	:type	ostm:		output stream
+	:param	iSeed:		Random seed for reproducible output, or None.
+	:type	iSeed:		int
+	:param	iStream:	Index of the independent random stream, under the same seed, of the first block.
+	:type	iStream:	int
+	:param	pProfile:	Distribution and structure of values; uniform and rectangular by default.
+	:type	pProfile:	CProfile
 
 	Note that most doctest maximum values are 0 to avoid random output.
 
@@ -91,14 +291,81 @@ def generate_random_table( iRows, iCols, dMissing, iFirst, dMax, ostm ):
 	tid	C000000	C000001	C000002
 	R000005	0	0	0
 	R000006	0	0	0
+
+	>>> generate_random_table( 2, 2, 1, 0, 1, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	tid	C000000	C000001
+	R000000		
+	R000001		
+
+	>>> generate_random_table( 3, 3, 0, 0, 0, sys.stdout, 1, 0, CProfile( "nbinom", 1, 0, 1, 1 ) ) #doctest: +SKIP
+	tid	C000000	C000001	C000002
+	R000000	0	0
+	R000000	0
+	R000001	0	0	0
 	"""
 
 	csvw = csv.writer( ostm, csv.excel_tab )
 	csvw.writerow( ["tid"] + [( "C%06d" % i ) for i in range( iCols )] )
-	for iRow in range( iRows ):
-		csvw.writerow( ["R%06d" % ( iRow + iFirst )] +
-			[( None if ( dMissing and ( random.random( ) <= dMissing ) ) else
-			( "%g" % ( dMax * random.random( ) ) ) ) for i in range( iCols )] )
+	pProfile = pProfile or CProfile( )
+	iBlock = _block_rows( iCols )
+	for iRow in range( 0, iRows, iBlock ):
+		pRandom = _generator( iSeed, iStream + ( iRow / iBlock ) )
+		ostm.write( _block( pRandom, min( iBlock, iRows - iRow ), iCols, dMissing, iFirst + iRow, dMax, pProfile ) )
+
+def _shard( pArgs ):
+	"""
+	Writes one shard file; a picklable entry point for worker processes.
+	"""
+
+	strOut, aArgs = pArgs[0], pArgs[1:]
+	with open( strOut, "wb" ) as ostm:
+		generate_random_table( *( aArgs[:5] + (ostm,) + aArgs[5:] ) )
+	return strOut
+
+def generate_random_shards( iRows, iCols, dMissing, iFirst, dMax, strOut, iShards, iSeed = None, pProfile = None ):
+	"""
+	Creates a random table split by row range into iShards files written in parallel.
+	
+	Each shard is a complete table (with headers) whose row IDs continue where the
+	previous shard's stop.  Shards split the table at block boundaries and continue
+	its blocks' random streams, so concatenating the shards' data rows gives the same
+	iRows-row table under a fixed seed whatever the number of shards.  Shard files are
+	named by inserting a zero-padded shard number before the extension of strOut.
+	
+	:param	strOut:		Output path from which shard file names are derived.
+	:type	strOut:		string
+	:param	iShards:	Number of shard files and worker processes.
+	:type	iShards:	int
+	:returns:			list of strings -- shard file names
+	
+	Other parameters are as for :py:func:`generate_random_table`.
+
+	>>> import shutil, tempfile
+	>>> strDir = tempfile.mkdtemp( )
+	>>> def funcData( astrFiles ):
+	...     return "".join( open( s, "rb" ).read( ).split( "\\r\\n", 1 )[1] for s in astrFiles )
+	>>> astrOne = generate_random_shards( 10, 1 << 16, 0.1, 0, 1, os.path.join( strDir, "one.pcl" ), 1, 7 )
+	>>> astrThree = generate_random_shards( 10, 1 << 16, 0.1, 0, 1, os.path.join( strDir, "three.pcl" ), 3, 7 )
+	>>> [os.path.basename( s ) for s in astrThree]
+	['three_000.pcl', 'three_001.pcl', 'three_002.pcl']
+	>>> funcData( astrOne ) == funcData( astrThree )
+	True
+	>>> shutil.rmtree( strDir )
+	"""
+
+	strBase, strExt = os.path.splitext( strOut )
+	iBlock = _block_rows( iCols )
+	iBlocks = ( iRows + iBlock - 1 ) / iBlock
+	apArgs = []
+	for iShard in range( iShards ):
+		iBegin, iEnd = (min( iRows, iBlock * ( ( iBlocks * i ) / iShards ) ) for i in (iShard, iShard + 1))
+		apArgs.append( ("%s_%03d%s" % (strBase, iShard, strExt), iEnd - iBegin, iCols, dMissing,
+			iFirst + iBegin, dMax, iSeed, iBegin / iBlock, pProfile) )
+	pPool = multiprocessing.Pool( min( iShards, multiprocessing.cpu_count( ) ) )
+	try:
+		return pPool.map( _shard, apArgs, 1 )
+	finally:
+		pPool.terminate( )
 
 argp = argparse.ArgumentParser( prog = "generate_random_table.py",
 	description = """Generates a random tab-delimited text table.""" )
@@ -117,11 +384,44 @@ argp.add_argument( "-f",		dest = "iFirst",	metavar = "first",
 argp.add_argument( "-x",		dest = "dMax",		metavar = "maximum",
 	type = float,	default = 1,
 	help = "Maximum value to output" )
+argp.add_argument( "-s",		dest = "iSeed",		metavar = "seed",
+	type = int,
+	help = "Random seed for reproducible output" )
+argp.add_argument( "--shards",	dest = "iShards",	metavar = "shards",
+	type = int,		default = 0,
+	help = "Write this many row-range shard files in parallel (requires -o)" )
+argp.add_argument( "-o",		dest = "strOut",	metavar = "output.pcl",
+	help = "Output path from which shard file names are derived" )
+argp.add_argument( "-p",		dest = "strDistribution",	metavar = "distribution",
+	choices = CProfile.c_astrDistributions,	default = "uniform",
+	help = "Value distribution: uniform in [0, max), nbinom counts with mean max, or lognormal with median max" )
+argp.add_argument( "--shape",	dest = "dShape",	metavar = "shape",
+	type = float,	default = 1,
+	help = "Negative binomial size (inverse dispersion) or log-normal log-scale standard deviation" )
+argp.add_argument( "-z",		dest = "dZeros",	metavar = "zeros",
+	type = float,	default = 0,
+	help = "Fraction of values replaced by zeros" )
+argp.add_argument( "--ragged",	dest = "dRagged",	metavar = "skew",
+	type = float,	default = 0,
+	help = "Truncate rows to skewed lengths; larger values give shorter rows" )
+argp.add_argument( "--duplicates",	dest = "dDuplicates",	metavar = "fraction",
+	type = float,	default = 0,
+	help = "Fraction of row IDs repeating an earlier ID" )
+argp.add_argument( "--unsorted",	dest = "fUnsorted",	action = "store_true",
+	help = "Shuffle rows so that IDs are not sorted" )
 __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	generate_random_table( args.iRows, args.iCols, args.dMissing, args.iFirst, args.dMax, sys.stdout )
+	pProfile = CProfile( args.strDistribution, args.dShape, args.dZeros, args.dRagged, args.dDuplicates, args.fUnsorted )
+	if args.iShards:
+		if not args.strOut:
+			argp.error( "--shards requires -o" )
+		generate_random_shards( args.iRows, args.iCols, args.dMissing, args.iFirst, args.dMax,
+			args.strOut, args.iShards, args.iSeed, pProfile )
+	else:
+		generate_random_table( args.iRows, args.iCols, args.dMissing, args.iFirst, args.dMax, sys.stdout,
+			args.iSeed, 0, pProfile )
 
 if __name__ == "__main__":
 	_main( )
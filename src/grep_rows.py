@@ -63,9 +63,21 @@ Examples
 """
 
 import argparse
+import cStringIO
 import csv
+import itertools
+import multiprocessing
+import sfle
 import sys
 
+c_iBlock	= 1 << 20
+"""Approximate number of bytes filtered at a time by the raw line fast path."""
+c_iRange	= 1 << 26
+"""Maximum number of bytes filtered by each parallel task."""
+
+_hashWorker = {}
+"""Read-only matcher and input inherited by forked worker processes."""
+
 def grep_rows( aastrRows, aastrData, ostm, fInvert, iCol, fBeginning ):
 	"""
 	Outputs any rows whose value in the requested column is (or isn't) included in the given ID set. 
@@ -109,29 +121,232 @@ def grep_rows( aastrRows, aastrData, ostm, fInvert, iCol, fBeginning ):
 	>>> grep_rows( aastrRows, aastrData, sys.stdout, False, 0, True ) #doctest: +NORMALIZE_WHITESPACE
 	a	1
 	ab	2
+
+	>>> aastrRows = [["ab"], ["bac"]]
+	>>> aastrData = [s.split( " " ) for s in ("a 1", "abc 2", "ba 3", "bacd 4")]
+	>>> grep_rows( aastrRows, aastrData, sys.stdout, True, 0, True ) #doctest: +NORMALIZE_WHITESPACE
+	a	1
+	ba	3
+	"""
+
+	_grep( _matcher( _ids( aastrRows ), fBeginning ), aastrData, ostm, fInvert, iCol )
+
+def _ids( aastrRows ):
+	"""
+	Returns the set of non-blank, non-empty IDs in the first column of the given lines.
 	"""
 
 	setstrRows = set()
 	for astrLine in aastrRows:
 		if astrLine and astrLine[0]: # Only record non-blank, non-empty IDs
 			setstrRows.add( astrLine[0] )
-	
-	csvw = csv.writer( ostm, csv.excel_tab )
+	return setstrRows
+
+def _matcher( setstrRows, fBeginning ):
+	"""
+	Returns a function testing whether a key is (or, if fBeginning, begins with) one of the given IDs.
+
+	>>> funcMatch = _matcher( set(["ab", "bac"]), True )
+	>>> [funcMatch( s ) for s in ("a", "abc", "ba", "bacd")]
+	[False, True, False, True]
+	"""
+
+	if not fBeginning:
+		return setstrRows.__contains__
+	# Every prefix match is an exact match of some ID length, so only those lengths need testing
+	aiLengths = sorted( set( len( s ) for s in setstrRows ) )
+	def funcRet( strCur ):
+		for iLength in aiLengths:
+			if iLength > len( strCur ):
+				break
+			if strCur[:iLength] in setstrRows:
+				return True
+		return False
+	return funcRet
+
+def _terminator( strLine ):
+	"""
+	Returns the line terminator ending a raw line, so reserialized rows match the input's.
+
+	>>> [_terminator( s ) for s in ("a\\tb\\r\\n", "a\\tb\\n", "a\\tb")]
+	['\\r\\n', '\\n', '\\n']
+	"""
+
+	return ( "\r\n" if strLine.endswith( "\r\n" ) else "\n" )
+
+def _grep( funcMatch, aastrData, ostm, fInvert, iCol, strTerminator = "\r\n" ):
+	"""
+	Outputs any split rows whose value in the requested column does (or doesn't) satisfy funcMatch.
+	"""
+
+	csvw = csv.writer( ostm, csv.excel_tab, lineterminator = strTerminator )
 	for astrLine in aastrData:
 		if not astrLine:
 			continue
 		# Only handle non-blank lines in which the requested column's contents are in (or invertedly out) of our IDs
-		if fBeginning:
-			fMatch = False
-			for strRow in setstrRows:
-				if astrLine[iCol].startswith( strRow ):
-					fMatch = True
-					break
-		else:
-			fMatch = astrLine[iCol] in setstrRows
-		if fMatch != fInvert:
+		if funcMatch( astrLine[iCol] ) != fInvert:
 			csvw.writerow( astrLine )
 
+def _grep_buffer( funcMatch, pIn, iBegin, iEnd, ostm, fInvert, iCol ):
+	"""
+	Outputs any matching raw lines between two newline-aligned byte offsets of a string or memory map.
+	"""
+
+	iSplit = iCol + 1
+	while iBegin < iEnd:
+		# Work in newline-aligned blocks so that line splitting and output happen in bulk
+		iNext = min( iEnd, iBegin + c_iBlock )
+		if iNext < iEnd:
+			iNext = pIn.find( "\n", iNext, iEnd ) + 1 or iEnd
+		strBlock = pIn[iBegin:iNext]
+		if "\"" in strBlock:
+			# Quoted fields may hold delimiters or span lines, so let csv handle everything from here on,
+			# ending rows as the input's first line does so that one output never mixes terminators
+			strTerminator = _terminator( pIn[0:( pIn.find( "\n" ) + 1 ) or len( pIn )] )
+			return _grep( funcMatch, csv.reader( sfle.maplines( pIn, iBegin, iEnd ), csv.excel_tab ), ostm, fInvert,
+				iCol, strTerminator )
+		iBegin = iNext
+		astrOut = []
+		for strLine in strBlock.splitlines( True ):
+			strData = strLine.rstrip( "\r\n" )
+			if strData and ( funcMatch( strData.split( "\t", iSplit )[iCol] ) != fInvert ):
+				astrOut.append( strLine )
+		ostm.write( "".join( astrOut ) )
+
+def grep_buffer( aastrRows, pIn, ostm, fInvert, iCol, fBeginning ):
+	"""
+	Outputs any lines of a string or memory-mapped file whose value in the requested column
+	is (or isn't) included in the given ID set.  Equivalent to :py:func:`grep_rows`, but
+	only the requested field of each line is located, and matching lines are written
+	as their original bytes rather than being parsed and reserialized.  Input is
+	handed to ``csv`` from the first line containing a quote character onward.
+	
+	:param	aastrRows:	Split lines from which IDs are read (first column).
+	:type	aastrRows:	collection of string collections
+	:param	pIn:		Raw tab-delimited text from which data are read.
+	:type	pIn:		string or mmap
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	:param	fInvert:	If true, output unmatched rather than matched rows.
+	:type	fInvert:	bool
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fBeginning:	If true, match beginning rather than full ID.
+	:type	fBeginning:	bool
+	
+	>>> aastrRows = [[s] for s in "ecca"]
+	>>> strIn = "".join( ( "\\t".join( s ) + "\\n" ) for s in ("a1a", "a3b", "b5c", "c7d", "d9e", "d1f", "e3g") )
+	>>> grep_buffer( aastrRows, strIn, sys.stdout, False, 0, False ) #doctest: +NORMALIZE_WHITESPACE
+	a	1	a
+	a	3	b
+	c	7	d
+	e	3	g
+
+	>>> grep_buffer( aastrRows, strIn, sys.stdout, False, 2, False ) #doctest: +NORMALIZE_WHITESPACE
+	a	1	a
+	b	5	c
+	d	9	e
+
+	>>> grep_buffer( aastrRows, 'a\\t1\\n\\n"a"\\t2\\nb\\t3\\n', sys.stdout, True, 0, False ) #doctest: +NORMALIZE_WHITESPACE
+	b	3
+	"""
+
+	_grep_buffer( _matcher( _ids( aastrRows ), fBeginning ), pIn, 0, len( pIn ), ostm, fInvert, iCol )
+
+def grep_lines( aastrRows, astrLines, ostm, fInvert, iCol, fBeginning ):
+	"""
+	Outputs any raw lines whose value in the requested column is (or isn't) included in the
+	given ID set.  The stream equivalent of :py:func:`grep_buffer` for input that cannot be
+	memory-mapped, such as a pipe: lines are written as their original bytes, and from the
+	first line containing a quote character onward input is handed to ``csv``, which ends
+	rows with the first line's terminator.
+
+	:param	aastrRows:	Split lines from which IDs are read (first column).
+	:type	aastrRows:	collection of string collections
+	:param	astrLines:	Raw tab-delimited lines (with newlines) from which data are read.
+	:type	astrLines:	collection of strings
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	:param	fInvert:	If true, output unmatched rather than matched rows.
+	:type	fInvert:	bool
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fBeginning:	If true, match beginning rather than full ID.
+	:type	fBeginning:	bool
+
+	>>> astrLines = ["a\\t1\\r\\n", "b\\t2\\r\\n", '"a"\\t3\\r\\n']
+	>>> ostm = cStringIO.StringIO( )
+	>>> grep_lines( [["a"]], iter( astrLines ), ostm, False, 0, False )
+	>>> ostm.getvalue( )
+	'a\\t1\\r\\na\\t3\\r\\n'
+	"""
+
+	funcMatch = _matcher( _ids( aastrRows ), fBeginning )
+	iSplit = iCol + 1
+	strTerminator = None
+	for strLine in astrLines:
+		if strTerminator == None:
+			strTerminator = _terminator( strLine )
+		if "\"" in strLine:
+			return _grep( funcMatch, csv.reader( itertools.chain( [strLine], astrLines ), csv.excel_tab ), ostm,
+				fInvert, iCol, strTerminator )
+		strData = strLine.rstrip( "\r\n" )
+		if strData and ( funcMatch( strData.split( "\t", iSplit )[iCol] ) != fInvert ):
+			ostm.write( strLine )
+
+def _grep_range( aiRange ):
+	"""
+	Filters one byte range of the shared input in a worker process, returning the matching lines.
+	"""
+
+	ostm = cStringIO.StringIO( )
+	_grep_buffer( _hashWorker["funcMatch"], _hashWorker["pIn"], aiRange[0], aiRange[1], ostm,
+		_hashWorker["fInvert"], _hashWorker["iCol"] )
+	return ostm.getvalue( )
+
+def grep_parallel( aastrRows, pIn, ostm, fInvert, iCol, fBeginning, iJobs ):
+	"""
+	Outputs the same lines as :py:func:`grep_buffer`, filtering newline-aligned byte
+	ranges of the input in iJobs worker processes.  Workers share the ID set and
+	memory map read-only by forking, and their results are written in input order.
+	Input containing any quote character is filtered serially, since quoted fields
+	may span the boundaries between ranges.
+	
+	:param	aastrRows:	Split lines from which IDs are read (first column).
+	:type	aastrRows:	collection of string collections
+	:param	pIn:		Raw tab-delimited text from which data are read.
+	:type	pIn:		string or mmap
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	:param	fInvert:	If true, output unmatched rather than matched rows.
+	:type	fInvert:	bool
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fBeginning:	If true, match beginning rather than full ID.
+	:type	fBeginning:	bool
+	:param	iJobs:		Number of worker processes.
+	:type	iJobs:		int
+	
+	>>> strIn = "".join( ( "\\t".join( s ) + "\\n" ) for s in ("a1a", "a3b", "b5c", "c7d", "d9e", "d1f", "e3g") )
+	>>> grep_parallel( [[s] for s in "ecca"], strIn, sys.stdout, True, 0, False, 2 ) #doctest: +NORMALIZE_WHITESPACE
+	b	5	c
+	d	9	e
+	d	1	f
+	"""
+
+	funcMatch = _matcher( _ids( aastrRows ), fBeginning )
+	if ( iJobs < 2 ) or ( pIn.find( "\"" ) >= 0 ):
+		return _grep_buffer( funcMatch, pIn, 0, len( pIn ), ostm, fInvert, iCol )
+	_hashWorker.update( {"funcMatch" : funcMatch, "pIn" : pIn, "fInvert" : fInvert, "iCol" : iCol} )
+	pPool = multiprocessing.Pool( iJobs )
+	try:
+		# Several ranges per worker balance load while bounding each result held in memory
+		for strOut in pPool.imap( _grep_range, sfle.mapranges( pIn, max( 4 * iJobs, len( pIn ) / c_iRange ) ) ):
+			ostm.write( strOut )
+	finally:
+		pPool.terminate( )
+		_hashWorker.clear( )
+
 argp = argparse.ArgumentParser( prog = "grep_rows.py",
 	description = "Reads a list of row identifiers and outputs all input rows matching any of these IDs." )
 argp.add_argument( "-f",		dest = "fInvert",	action = "store_true",
@@ -141,6 +356,9 @@ argp.add_argument( "-c",		dest = "iCol",		metavar = "col",
 	help = "Data column in which IDs are matched (zero-indexed)" )
 argp.add_argument( "-b",		dest = "fBeginning",	action = "store_true",
 	help = "Match beginning rather than full ID" )
+argp.add_argument( "-j",		dest = "iJobs",		metavar = "jobs",
+	type = int,		default = 1,
+	help = "Number of processes filtering a regular (seekable) input file" )
 argp.add_argument( "istmRows",	metavar = "rows.txt",
 	type = argparse.FileType( "r" ),
 	help = "File from which row IDs to match are read" )
@@ -148,8 +366,13 @@ __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	grep_rows( csv.reader( args.istmRows, csv.excel_tab ), csv.reader( sys.stdin, csv.excel_tab ),
-		sys.stdout, args.fInvert, args.iCol, args.fBeginning )
+	mmapIn = sfle.mapfile( sys.stdin )
+	if mmapIn:
+		grep_parallel( csv.reader( args.istmRows, csv.excel_tab ), mmapIn, sys.stdout,
+			args.fInvert, args.iCol, args.fBeginning, args.iJobs )
+	else:
+		grep_lines( csv.reader( args.istmRows, csv.excel_tab ), sys.stdin, sys.stdout,
+			args.fInvert, args.iCol, args.fBeginning )
 	
 if __name__ == "__main__":
 	_main( )
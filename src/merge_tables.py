@@ -64,10 +64,512 @@ Examples
 """
 
 import argparse
+import array
+import cStringIO
 import csv
+import heapq
+import itertools
+import multiprocessing
+import operator
 import os
 import re
+import sfle
+import shutil
 import sys
+import tempfile
+
+c_iRowOverhead	= 64
+"""Approximate bytes of Python object overhead per buffered row and cell."""
+c_iMergeFanIn	= 64
+"""Maximum number of sorted runs merged (and thus held open) at once."""
+c_strSufIndex	= ".idx"
+"""Suffix appended to an input table's path to name its sidecar ID index."""
+
+def _quoted( strText, iBegin = 0, iEnd = None ):
+	"""
+	Returns true if (a span of) text holds characters that need csv parsing or quoting
+	rather than plain tab splitting; separate scans in C are much faster than a regex.
+
+	>>> _quoted( "a\tb" ), _quoted( 'a"b' ), _quoted( 'a"b', 0, 1 )
+	(False, True, False)
+	"""
+
+	iEnd = len( strText ) if ( iEnd == None ) else iEnd
+	return any( ( strText.find( s, iBegin, iEnd ) >= 0 ) for s in ('"', "\r", "\n") )
+
+def _columns( aiCols ):
+	"""
+	Returns a function that slices the given column indices out of a row as a tuple.
+
+	:param	aiCols:	Column indices to extract, in output order.
+	:type	aiCols:	collection of ints
+	:returns:		function -- maps a row to the tuple of its requested cells
+
+	>>> _columns( [2, 0] )( ["a", "b", "c"] )
+	('c', 'a')
+	>>> _columns( [1] )( ["a", "b", "c"] )
+	('b',)
+	>>> _columns( [] )( ["a", "b", "c"] )
+	()
+	"""
+
+	if not aiCols:
+		return ( lambda astrRow: () )
+	# itemgetter does the per-cell work in C, but returns a bare value for a single index
+	funcGet = operator.itemgetter( *aiCols )
+	return ( funcGet if ( len( aiCols ) > 1 ) else ( lambda astrRow: (funcGet( astrRow ),) ) )
+
+def _headers( aastrHeaders, astrLabels, fLabel ):
+	"""
+	Flattens per-table header lists, optionally prepending each with its table's label.
+
+	:param	aastrHeaders:	The list of non-ID headers for each input datum.
+	:type	aastrHeaders:	collection of string collections
+	:param	astrLabels:		Labels (typically file names) of input data.
+	:type	astrLabels:		collection of strings
+	:param	fLabel:			If true, prepend table name to each header.
+	:type	fLabel:			bool
+	:returns:				list of strings -- flattened output headers
+
+	>>> _headers( [["exp1", "exp2"], ["exp3"]], ["a/data1.pcl", "data2.pcl"], True )
+	['data1: exp1', 'data1: exp2', 'data2: exp3']
+	"""
+
+	"""
+	The following is Python black magic that I dislike, but it's an extremely
+	efficient way to flatten a list.  That is, given a list of lists of strings::
+	
+		[["a", "b"], ["c"], ["d", "e", "f"]]
+		
+	it flattens their contents into a single list::
+	
+		["a", "b", "c", "d", "e", "f"]
+		
+	To parse it, read it as "the list containing every element in every list in
+	``aastrHeaders``."
+	"""
+	astrRet = [s for a in aastrHeaders for s in a]
+	# If we're labeling headers, prepend each with ``labelname: ``.
+	if fLabel:
+		iHeader = 0
+		for iIn in range( len( aastrHeaders ) ):
+			for i in range( len( aastrHeaders[iIn] ) ):
+				astrRet[iHeader] = ": ".join( (re.sub( r'\.[^.]+$', "", os.path.basename( astrLabels[iIn] ) ),
+					astrRet[iHeader]) )
+				iHeader += 1
+	return astrRet
+
+def _index( aastrIn, iCol, fRows, fHeaders ):
+	"""
+	Parses one input table into its ID header, non-ID headers, data, and ID mapping.
+
+	:param	aastrIn:	Split lines from which data are read.
+	:type	aastrIn:	collection of string collections
+	:param	iCol:		Data column (or row, if fRows) in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fRows:		If true, match IDs on rows rather than columns.
+	:type	fRows:		bool
+	:param	fHeaders:	If true, assume first row is headers (column labels).
+	:type	fHeaders:	bool
+	:returns:			(string, string list, list of string lists, dict) -- ID header,
+						non-ID headers, data rows, and hash of IDs to row (or column) numbers
+
+	>>> strHeader, astrHeaders, aastrData, hashIDs = _index( [s.split( " " ) for s in ("tid exp1", "gene1 1", "gene2 3")], 0, False, True )
+	>>> strHeader, astrHeaders, aastrData, sorted( hashIDs.items( ) )
+	('tid', ['exp1'], [['1'], ['3']], [('gene1', 0), ('gene2', 1)])
+	"""
+
+	hashIDs = {}
+	"""Hash of IDs to row (or column) numbers."""
+	aastrData = CBlock( ) if fRows else []
+	"""Data table."""
+	astrHeaders = []
+	"""The list of non-ID headers."""
+	strHeader = None
+	"""The ID column header."""
+	# Start at line -2 so that headers are -1 and data are then 0-indexed
+	iLine = -2 if fHeaders else -1
+	for astrLine in aastrIn:
+		iLine += 1
+		# Handle indexing differently for rows versus columns
+		if fRows:
+			strID, astrData = astrLine[0], astrLine[1:]
+			if not fHeaders:
+				strID, astrData = str(iLine), astrLine
+			if ( iLine + 1 ) == iCol:
+				if not strHeader:
+					strHeader = strID
+				for i in range( len( astrData ) ):
+					hashIDs[astrData[i]] = i
+			else:
+				astrHeaders.append( strID )
+				aastrData.append_cells( astrData )
+		else:
+			# ID is from requested column, data are everything else
+			strID, astrData = astrLine[iCol], ( astrLine[:iCol] + astrLine[( iCol + 1 ):] )
+			if iLine >= 0:
+				# Without headers, columns are numbered after the widest row
+				if not fHeaders:
+					astrHeaders += [str(i) for i in range( len( astrHeaders ), len( astrData ) )]
+				elif not astrHeaders:
+					astrHeaders = [str(i) for i in range( len( astrData ) )]
+				hashIDs[strID] = iLine
+				aastrData.append( astrData )
+			else:
+				if not strHeader:
+					strHeader = strID
+				astrHeaders = astrData
+	return (strHeader, astrHeaders, aastrData, hashIDs)
+
+class CBlock:
+	"""
+	Data rows of one table for a column-wise join, each kept as the raw tab-delimited text of
+	its cells and addressed by arrays of offsets, lengths, and cell
+	counts rather than as one string per cell.  The text stays in the input file when that
+	can be reread, and otherwise goes to one in-memory buffer; rows with quoted cells are
+	kept parsed.
+
+	>>> pBlock = CBlock( )
+	>>> pBlock.append_cells( ["1", "2"] )
+	>>> pBlock.append_cells( ["a\\tb"] )
+	>>> len( pBlock ), pBlock.width( ), list( pBlock )
+	(2, 2, [('1\\t2', None, 2), (None, ['a\\tb'], 1)])
+	"""
+
+	def __init__( self, strFile = None ):
+
+		self.m_strFile = strFile
+		self.m_ostmText = None if strFile else cStringIO.StringIO( )
+		self.m_aiBegins, self.m_aiLengths, self.m_aiWidths = (array.array( "l" ) for i in range( 3 ))
+		self.m_hashCells = {}
+		"""Parsed cells of rows whose text could not be split on tabs, by row number."""
+
+	def __len__( self ):
+
+		return len( self.m_aiWidths )
+
+	def width( self ):
+
+		return max( self.m_aiWidths or [0] )
+
+	def append_span( self, iBegin, iLength, iWidth ):
+
+		self.m_aiBegins.append( iBegin )
+		self.m_aiLengths.append( iLength )
+		self.m_aiWidths.append( iWidth )
+
+	def append( self, strText, iWidth ):
+
+		self.append_span( self.m_ostmText.tell( ), len( strText ), iWidth )
+		self.m_ostmText.write( strText )
+
+	def append_cells( self, astrCells ):
+
+		strText = "\t".join( astrCells )
+		if self.m_ostmText and ( strText.count( "\t" ) == max( 0, len( astrCells ) - 1 ) ) and \
+			not _quoted( strText ):
+			return self.append( strText, len( astrCells ) )
+		self.m_hashCells[len( self )] = list(astrCells)
+		self.append_span( 0, 0, len( astrCells ) )
+
+	def __iter__( self ):
+		"""
+		Yields each row as its text (or None), its parsed cells (or None), and its cell count.
+		"""
+
+		if self.m_strFile:
+			fileText = open( self.m_strFile, "rb" )
+			def funcText( iBegin, iLength ):
+				fileText.seek( iBegin )
+				return fileText.read( iLength )
+		else:
+			fileText = None
+			strBuffer = self.m_ostmText.getvalue( )
+			funcText = lambda iBegin, iLength: strBuffer[iBegin:( iBegin + iLength )]
+		try:
+			for iRow in range( len( self ) ):
+				astrCells = self.m_hashCells.get( iRow )
+				yield (( None if ( astrCells != None ) else
+					funcText( self.m_aiBegins[iRow], self.m_aiLengths[iRow] ) ), astrCells, self.m_aiWidths[iRow])
+		finally:
+			if fileText:
+				fileText.close( )
+
+def _index_rows( fileIn, iCol, fHeaders, strFile = None ):
+	"""
+	Indexes one input table for a column-wise join from its raw lines, splitting rows on
+	tabs only to find their IDs and falling back to csv parsing for lines with quotes.
+
+	:param	fileIn:		Input stream from which raw lines are read.
+	:type	fileIn:		input stream
+	:param	iCol:		Data row in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fHeaders:	If true, assume first column is headers (row labels).
+	:type	fHeaders:	bool
+	:param	strFile:	Path of the file underlying fileIn, from which row text is reread, or None.
+	:type	strFile:	string
+	:returns:			tuple -- as returned by :py:func:`_index`
+
+	>>> strHeader, astrHeaders, pBlock, hashIDs = _index_rows( cStringIO.StringIO(
+	...     "tid\\tgene1\\tgene2\\r\\nexp1\\t1\\t2\\r\\nexp2\\t\\"3\\"\\n" ), 0, True )
+	>>> strHeader, astrHeaders, list( pBlock ), sorted( hashIDs.items( ) )
+	('tid', ['exp1', 'exp2'], [('1\\t2', None, 2), ('3', None, 1)], [('gene1', 0), ('gene2', 1)])
+	"""
+
+	pBlock = CBlock( strFile )
+	hashIDs = {}
+	astrHeaders = []
+	strHeader = None
+	# Start at line -2 so that headers are -1 and data are then 0-indexed
+	iLine = -2 if fHeaders else -1
+	iOffset = 0
+	iterLines = iter( fileIn.readline, "" )
+	for strLine in iterLines:
+		iLine += 1
+		iBegin = iOffset
+		iOffset += len( strLine )
+		# Wide rows are scanned in place between bounds rather than copied by slicing
+		iEnd = len( strLine )
+		iEnd -= 1 if strLine.endswith( "\n", 0, iEnd ) else 0
+		iEnd -= 1 if strLine.endswith( "\r", 0, iEnd ) else 0
+		astrData = None
+		if _quoted( strLine, 0, iEnd ):
+			# Quoted cells may span lines, which the csv reader pulls from the same iterator
+			astrData = next( csv.reader( itertools.chain( [strLine], iterLines ), csv.excel_tab ) )
+			if strFile:
+				iOffset = fileIn.tell( )
+			strID, astrData = ( astrData[0], astrData[1:] ) if fHeaders else ( str(iLine), astrData )
+		else:
+			iStart = ( strLine.find( "\t", 0, iEnd ) + 1 ) if fHeaders else 0
+			strID = ( strLine[:( ( iStart - 1 ) if iStart else iEnd )] ) if fHeaders else str(iLine)
+			iCells = ( strLine.count( "\t", iStart, iEnd ) + 1 ) if ( iStart or ( iEnd and not fHeaders ) ) else 0
+		if ( iLine + 1 ) == iCol:
+			if not strHeader:
+				strHeader = strID
+			if astrData == None:
+				astrData = strLine[iStart:iEnd].split( "\t" ) if iCells else []
+			for i in range( len( astrData ) ):
+				hashIDs[astrData[i]] = i
+			continue
+		astrHeaders.append( strID )
+		if astrData != None:
+			pBlock.append_cells( astrData )
+		elif strFile:
+			pBlock.append_span( iBegin + iStart, iEnd - iStart, iCells )
+		else:
+			pBlock.append( strLine[iStart:iEnd], iCells )
+	return (strHeader, astrHeaders, pBlock, hashIDs)
+
+def _index_file( pArgs ):
+	"""
+	Opens and indexes one input table; a picklable entry point for worker processes.
+
+	:param	pArgs:	File name followed by the remaining arguments of :py:func:`_index`.
+	:type	pArgs:	tuple
+	:returns:		tuple -- as returned by :py:func:`_index`
+	"""
+
+	strFile, iCol, fRows, fHeaders = pArgs
+	if fRows:
+		with open( strFile, "rb" ) as fileIn:
+			return _index_rows( fileIn, iCol, fHeaders, strFile )
+	with open( strFile ) as fileIn:
+		return _index( csv.reader( fileIn, csv.excel_tab ), iCol, fRows, fHeaders )
+
+def _line( strLine ):
+	"""
+	Splits one raw tab-delimited line as ``csv.reader`` would.
+
+	>>> _line( "a\\tb\\t\\n" )
+	['a', 'b', '']
+	"""
+
+	return next( csv.reader( [strLine], csv.excel_tab ), [] )
+
+class CRows:
+	"""
+	Lazily read data rows of an indexed table, looked up by byte offset rather than row number.
+	"""
+
+	def __init__( self, fileIn, iCol ):
+
+		self.m_fileIn = fileIn
+		self.m_iCol = iCol
+
+	def __getitem__( self, iOffset ):
+
+		self.m_fileIn.seek( iOffset )
+		astrLine = _line( self.m_fileIn.readline( ) )
+		return ( astrLine[:self.m_iCol] + astrLine[( self.m_iCol + 1 ):] )
+
+def _stamp( strFile, iCol, fHeaders ):
+	"""
+	Returns the fields identifying the version of a table (and indexing options) an index describes.
+	"""
+
+	pStat = os.stat( strFile )
+	return ["#" + c_strSufIndex, str(pStat.st_size), repr( pStat.st_mtime ), str(iCol), str(int(fHeaders))]
+
+def _read_index( strIndex, astrStamp ):
+	"""
+	Returns the ID to byte offset hash and widest data row stored in a sidecar index, or None if
+	it is missing or stale.
+	"""
+
+	try:
+		with open( strIndex, "rb" ) as fileIndex:
+			csvr = csv.reader( fileIndex, csv.excel_tab )
+			# The stamp row ends with the width, so indices written without one are stale
+			astrLine = next( csvr, [] )
+			if astrLine[:-1] != astrStamp:
+				return None
+			iWidth = int(astrLine[-1])
+			return (dict( (astrLine[0], int(astrLine[1])) for astrLine in csvr ), iWidth)
+	except (IOError, ValueError, IndexError, csv.Error):
+		return None
+
+def _write_index( strIndex, astrStamp, hashOffsets, iWidth ):
+	"""
+	Atomically writes a sidecar index; failure (e.g. a read-only directory) only costs a rebuild next time.
+	"""
+
+	strTmp = "%s.%d" % (strIndex, os.getpid( ))
+	try:
+		with open( strTmp, "wb" ) as fileIndex:
+			csvw = csv.writer( fileIndex, csv.excel_tab )
+			csvw.writerow( astrStamp + [str(iWidth)] )
+			csvw.writerows( hashOffsets.iteritems( ) )
+		os.rename( strTmp, strIndex )
+	except (IOError, OSError):
+		if os.path.exists( strTmp ):
+			os.remove( strTmp )
+
+def index_file( strFile, iCol, fHeaders ):
+	"""
+	Indexes one input table by ID without holding its data in memory, reusing the
+	sidecar index stored next to it (``strFile`` plus ``c_strSufIndex``) when that
+	index is still valid.  The index maps each ID to the byte offset of its row and
+	is rebuilt whenever the table's size or modification time (or the requested ID
+	column or header setting) changes.  Rows must not contain quoted line breaks.
+	
+	:param	strFile:	Path of a tab-delimited text table.
+	:type	strFile:	string
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fHeaders:	If true, assume first row is headers (column labels).
+	:type	fHeaders:	bool
+	:returns:			tuple -- as returned by :py:func:`_index`, with a :py:class:`CRows`
+						in place of the data and byte offsets in place of row numbers
+	
+	>>> strDir = tempfile.mkdtemp( )
+	>>> strFile = os.path.join( strDir, "data1.pcl" )
+	>>> with open( strFile, "w" ) as fileOut:
+	...     fileOut.write( "tid\\texp1\\texp2\\ngene2\\t3\\t4\\ngene1\\t1\\t2\\n" )
+	>>> strHeader, astrHeaders, aastrData, hashIDs = index_file( strFile, 0, True )
+	>>> strHeader, astrHeaders, aastrData[hashIDs["gene1"]]
+	('tid', ['exp1', 'exp2'], ['1', '2'])
+	>>> os.path.exists( strFile + c_strSufIndex )
+	True
+	>>> index_file( strFile, 0, True )[3] == hashIDs
+	True
+	>>> shutil.rmtree( strDir )
+	"""
+
+	astrStamp = _stamp( strFile, iCol, fHeaders )
+	strIndex = strFile + c_strSufIndex
+	fileIn = open( strFile, "rb" )
+	pIndex = _read_index( strIndex, astrStamp )
+	if pIndex == None:
+		hashOffsets, iWidth = {}, 0
+		iOffset = 0
+		for strLine in iter( fileIn.readline, "" ):
+			if iOffset or not fHeaders:
+				astrLine = _line( strLine )
+				hashOffsets[astrLine[iCol]] = iOffset
+				iWidth = max( iWidth, len( astrLine ) - 1 )
+			iOffset += len( strLine )
+		_write_index( strIndex, astrStamp, hashOffsets, iWidth )
+	else:
+		hashOffsets, iWidth = pIndex
+	fileIn.seek( 0 )
+	astrLine = _line( fileIn.readline( ) )
+	astrData = astrLine[:iCol] + astrLine[( iCol + 1 ):]
+	if fHeaders:
+		strHeader, astrHeaders = ( astrLine[iCol] if astrLine else None ), astrData
+	else:
+		strHeader, astrHeaders = None, [str(i) for i in range( iWidth )]
+	return (strHeader, astrHeaders, CRows( fileIn, iCol ), hashOffsets)
+
+def _join( apTables, astrLabels, fLabel, fRows, ostm ):
+	"""
+	Outputs the table join of already indexed input tables.
+
+	:param	apTables:	One tuple per input datum as returned by :py:func:`_index`.
+	:type	apTables:	collection of tuples
+	:param	astrLabels:	Labels (typically file names) of input data.
+	:type	astrLabels:	collection of strings
+	:param	fLabel:		If true, prepend table name to header row.
+	:type	fLabel:		bool
+	:param	fRows:		If true, match IDs on rows rather than columns.
+	:type	fRows:		bool
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	"""
+
+	setstrIDs = set()
+	"""The final set of all IDs in any table."""
+	strHeader = None
+	"""The ID column header."""
+	for strCur, astrHeaders, aastrData, hashIDs in apTables:
+		# Remember the first ID header name we see for output
+		if not strHeader:
+			strHeader = strCur
+		# Batch merge every new ID key set
+		setstrIDs.update( hashIDs.keys( ) )
+	aastrHeaders, aaastrData, ahashIDs = ([p[i] for p in apTables] for i in range( 1, 4 ))
+
+	csvw = csv.writer( ostm, csv.excel_tab )
+	astrHeaders = _headers( aastrHeaders, astrLabels, fLabel )
+
+	# Handle output differently for rows versus columns
+	if fRows:
+		astrIDs = sorted( setstrIDs )
+		# Keys go in first row rather than each row
+		csvw.writerow( [strHeader] + astrIDs )
+		iHeader = -1
+		for iIn in range( len( apTables ) ):
+			pBlock, hashIDs = (a[iIn] for a in (aaastrData, ahashIDs))
+			# Look up the column numbers (if any) of all IDs in one shot; missing IDs
+			# point one past the widest column, where each row is padded with None
+			iWidth = max( [0, pBlock.width( )] + [1 + i for i in hashIDs.values( )] )
+			aiCols = [hashIDs.get( s, iWidth ) for s in astrIDs]
+			funcRow = _columns( aiCols )
+			# When IDs already sit in output order, a row's text is written as it was read
+			fInPlace = aiCols == range( len( aiCols ) )
+			for strText, astrData, iCells in pBlock:
+				iHeader += 1
+				strHeader = astrHeaders[iHeader]
+				if fInPlace and ( strText != None ) and ( 0 < iCells <= len( aiCols ) ) and \
+					not ( ( "\t" in strHeader ) or _quoted( strHeader ) ):
+					ostm.write( "".join( (strHeader, "\t", strText, "\t" * ( len( aiCols ) - iCells ), "\r\n") ) )
+					continue
+				if astrData == None:
+					astrData = strText.split( "\t" ) if iCells else []
+				csvw.writerow( (strHeader,) + funcRow( astrData + [None] * ( iWidth + 1 - len( astrData ) ) ) )
+	else:
+		csvw.writerow( [strHeader] + astrHeaders )
+		for strID in sorted( setstrIDs ):
+			astrOut = []
+			for iIn in range( len( apTables ) ):
+				aastrData, hashIDs = (a[iIn] for a in (aaastrData, ahashIDs))
+				# Look up the row number of the current ID in the current dataset, if any
+				iID = hashIDs.get( strID )
+				# If not, start with no data; if yes, lift out stored data row
+				astrData = [] if ( iID == None ) else aastrData[iID]
+				# Pad output data to correct length (possibly starting from nothing)
+				astrData += [None] * ( len( aastrHeaders[iIn] ) - len( astrData ) )
+				astrOut += astrData
+			csvw.writerow( [strID] + astrOut )
 
 def merge( aaastrIn, astrLabels, fLabel, iCol, fRows, fHeaders, ostm ):
 	"""
@@ -131,110 +633,326 @@ def merge( aaastrIn, astrLabels, fLabel, iCol, fRows, fHeaders, ostm ):
 	data2: gene5		0.5	0.6
 	"""
 	
-	setstrIDs = set()
-	"""The final set of all IDs in any table."""
-	ahashIDs = [{} for i in range( len( aaastrIn ) )]
-	"""One hash of IDs to row numbers for each input datum."""
-	aaastrData = [[] for i in range( len( aaastrIn ) )]
-	"""One data table for each input datum."""
-	aastrHeaders = [[] for i in range( len( aaastrIn ) )]
+	return _join( [_index( a, iCol, fRows, fHeaders ) for a in aaastrIn], astrLabels, fLabel, fRows, ostm )
+
+def merge_files( astrFiles, fLabel, iCol, fRows, fHeaders, iJobs, ostm, fIndex = False ):
+	"""
+	Outputs the table join of the given tab-delimited files, parsing and indexing
+	them in parallel.  Each worker process reads one table and returns its headers,
+	data, and ID mapping, which are then joined exactly as by :py:func:`merge`.
+	Column-wise joins leave each table's rows in its file, recording only where each
+	row lies (see :py:class:`CBlock`), and reread them as they are output.
+	Alternatively, tables can be joined row-wise through persistent sidecar indices
+	(see :py:func:`index_file`), reading each data row directly when it is output.
+	
+	:param	astrFiles:	Paths of one or more tab-delimited text tables.
+	:type	astrFiles:	collection of strings
+	:param	fLabel:		If true, prepend table name to header row.
+	:type	fLabel:		bool
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fRows:		If true, match IDs on rows rather than columns.
+	:type	fRows:		bool
+	:param	fHeaders:	If true, assume first row is headers (column labels).
+	:type	fHeaders:	bool
+	:param	iJobs:		Number of worker processes.
+	:type	iJobs:		int
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	:param	fIndex:		If true, build and reuse sidecar ID indices (row-wise joins only).
+	:type	fIndex:		bool
+	"""
+
+	apArgs = [(s, iCol, fRows, fHeaders) for s in astrFiles]
+	if fIndex:
+		if fRows:
+			raise ValueError( "Sidecar indices only support row-wise joins" )
+		apTables = [index_file( s, iCol, fHeaders ) for s in astrFiles]
+	elif ( iJobs > 1 ) and ( len( astrFiles ) > 1 ):
+		pPool = multiprocessing.Pool( min( iJobs, len( astrFiles ) ) )
+		try:
+			apTables = pPool.map( _index_file, apArgs, 1 )
+		finally:
+			pPool.terminate( )
+	else:
+		apTables = [_index_file( p ) for p in apArgs]
+	return _join( apTables, astrFiles, fLabel, fRows, ostm )
+
+def _sorted_rows( aastrIn, iCol, strLabel ):
+	"""
+	Yields (ID, data) pairs from the data rows of one table, checking that IDs never decrease.
+
+	:param	aastrIn:	Split data lines (headers already consumed) from which data are read.
+	:type	aastrIn:	collection of string collections
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	strLabel:	Label (typically file name) of the input datum, used in errors.
+	:type	strLabel:	string
+	:returns:			generator of (string, string list) -- ID and non-ID data of each row
+
+	>>> list( _sorted_rows( [["a", "1"], ["b", "2"]], 0, "data1.pcl" ) )
+	[('a', ['1']), ('b', ['2'])]
+	"""
+
+	strPrev = None
+	for astrLine in aastrIn:
+		strID, astrData = astrLine[iCol], ( astrLine[:iCol] + astrLine[( iCol + 1 ):] )
+		if ( strPrev != None ) and ( strID < strPrev ):
+			raise ValueError( "Input not sorted by ID: %s after %s in %s" % (strID, strPrev, strLabel) )
+		strPrev = strID
+		yield (strID, astrData)
+
+class CReader:
+	"""
+	Split lines of a seekable tab-delimited stream, read again from the start on every iteration.
+
+	>>> pReader = CReader( cStringIO.StringIO( "a\\t1\\nb\\t2\\n" ) )
+	>>> list( pReader ) == list( pReader ) == [["a", "1"], ["b", "2"]]
+	True
+	"""
+
+	def __init__( self, fileIn ):
+
+		self.m_fileIn = fileIn
+		self.m_iStart = fileIn.tell( )
+
+	def __iter__( self ):
+
+		self.m_fileIn.seek( self.m_iStart )
+		return csv.reader( self.m_fileIn, csv.excel_tab )
+
+def _numbered( iWidth, iCol ):
+	"""
+	Returns a header line numbering iWidth data columns around a blank ID header in column iCol.
+
+	>>> _numbered( 2, 1 )
+	['0', '', '1']
+	"""
+
+	astrRet = [str(i) for i in range( iWidth )]
+	astrRet.insert( iCol, "" )
+	return astrRet
+
+def merge_sorted( aaastrIn, astrLabels, fLabel, iCol, fHeaders, ostm ):
+	"""
+	Outputs the row-wise table join of the given pre-split string collections,
+	each of which must already be sorted by ID.  Tables are consumed in a single
+	streaming k-way merge holding only one row per input in memory, and output is
+	identical to that of :py:func:`merge` on the same data.  Without headers, columns
+	are numbered after each table's widest row, so each table is first read through
+	to find it and must then be a collection that can be iterated again (e.g. a
+	:py:class:`CReader`).
+	
+	:param	aaastrIn:	One or more split lines from which data are read.
+	:type	aaastrIn:	collection of collections of string collections
+	:param	astrLabels:	Labels (typically file names) of input data.
+	:type	astrLabels:	collection of strings
+	:param	fLabel:		If true, prepend table name to header row.
+	:type	fLabel:		bool
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fHeaders:	If true, assume first row is headers (column labels).
+	:type	fHeaders:	bool
+	:param	ostm:		Output stream to which matched rows are written.
+	:type	ostm:		output stream
+	
+	>>> astrLabels = ["data1.pcl", "data2.pcl"]
+	>>> aastrOne = [s.split( " " ) for s in ("tid exp1 exp2", "gene1 1 2", "gene2 3 4", "gene3 5 6")]
+	>>> aastrTwo = [s.split( " " ) for s in ("tid exp2 exp3", "gene1 0.1 0.2", "gene3 0.3 0.4", "gene5 0.5 0.6")]
+	>>> merge_sorted( [aastrOne, aastrTwo], astrLabels, False, 0, True, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	tid	exp1	exp2	exp2	exp3
+	gene1	1	2	0.1	0.2
+	gene2	3	4		
+	gene3	5	6	0.3	0.4
+	gene5			0.5	0.6
+
+	>>> merge_sorted( [aastrTwo, aastrOne], astrLabels, True, 0, True, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+	tid	data1: exp2	data1: exp3	data2: exp1	data2: exp2
+	gene1	0.1	0.2	1	2
+	gene2			3	4
+	gene3	0.3	0.4	5	6
+	gene5	0.5	0.6		
+
+	>>> merge_sorted( [aastrOne[::-1]], astrLabels, False, 0, False, sys.stdout )
+	Traceback (most recent call last):
+	...
+	ValueError: Input not sorted by ID: gene2 after gene3 in data1.pcl
+
+	Ragged tables without headers are joined as by :py:func:`merge`, whether sorted
+	beforehand or by :py:func:`sort_table`:
+
+	>>> aastrOne = [s.split( " " ) for s in ("b 3", "a 1 2 9", "c 5 6")]
+	>>> aastrTwo = [s.split( " " ) for s in ("c 0.1", "a 0.3 0.4")]
+	>>> merge( [aastrOne, aastrTwo], astrLabels, False, 0, False, False, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+		0	1	2	0	1
+	a	1	2	9	0.3	0.4
+	b	3				
+	c	5	6		0.1	
+	>>> merge_sorted( [sorted( aastrOne ), sorted( aastrTwo )], astrLabels, False, 0, False, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+		0	1	2	0	1
+	a	1	2	9	0.3	0.4
+	b	3				
+	c	5	6		0.1	
+	>>> merge_sorted( [sort_table( aastrOne, 0, False, 1 ), sort_table( aastrTwo, 0, False, 1 )],
+	...     astrLabels, False, 0, True, sys.stdout ) #doctest: +NORMALIZE_WHITESPACE
+		0	1	2	0	1
+	a	1	2	9	0.3	0.4
+	b	3				
+	c	5	6		0.1	
+	"""
+
+	if not fHeaders:
+		aaastrIn = [itertools.chain( [_numbered( max( [0] + [( len( a ) - 1 ) for a in aastrIn] ), iCol )], aastrIn )
+			for aastrIn in aaastrIn]
+		fHeaders = True
+
+	aastrHeaders = []
 	"""The list of non-ID headers for each input datum."""
 	strHeader = None
 	"""The ID column header."""
-	# For each input datum...
+	apHeap = []
+	"""The current (ID, table index, data) row of each non-exhausted input datum."""
+	agenRows = []
+	"""One sorted row generator for each input datum."""
 	for iIn in range( len( aaastrIn ) ):
-		# Remember its input line list, output line list, and ID mapping
-		aastrIn, aastrData, hashIDs = (a[iIn] for a in (aaastrIn, aaastrData, ahashIDs))
-		# Start at line -2 so that headers are -1 and data are then 0-indexed
-		iLine = -2 if fHeaders else -1
-		for astrLine in aastrIn:
-			iLine += 1
-			# Handle indexing differently for rows versus columns
-			if fRows:
-				strID, astrData = astrLine[0], astrLine[1:]
-				if not fHeaders:
-					strID, astrData = str(iLine), astrLine
-				if ( iLine + 1 ) == iCol:
-					# Remember the first ID header name we see for output
-					if not strHeader:
-						strHeader = strID
-					for i in range( len( astrData ) ):
-						hashIDs[astrData[i]] = i
-				else:
-					# This should only trigger the first time to initialize the data matrix
-					while len( aastrData ) < len( astrData ):
-						aastrData.append( [] )
-					aastrHeaders[iIn].append( strID )
-					for i in range( len( astrData ) ):
-						aastrData[i].append( astrData[i] )
-			else:
-				# ID is from requested column, data are everything else
-				strID, astrData = astrLine[iCol], ( astrLine[:iCol] + astrLine[( iCol + 1 ):] )
-				if iLine >= 0:
-					if not aastrHeaders[iIn]:
-						aastrHeaders[iIn] = [str(i) for i in range( len( astrData ) )]
-					hashIDs[strID] = iLine
-					aastrData.append( astrData )
-				else:
-					# Remember the first ID header name we see for output
-					if not strHeader:
-						strHeader = strID
-					aastrHeaders[iIn] = astrData
-		# Batch merge every new ID key set
-		setstrIDs.update( hashIDs.keys( ) )
-		
+		iterIn = iter( aaastrIn[iIn] )
+		astrHeaders = None
+		if fHeaders:
+			astrLine = next( iterIn, None )
+			if astrLine != None:
+				# Remember the first ID header name we see for output
+				if not strHeader:
+					strHeader = astrLine[iCol]
+				astrHeaders = astrLine[:iCol] + astrLine[( iCol + 1 ):]
+		genRows = _sorted_rows( iterIn, iCol, astrLabels[iIn] )
+		agenRows.append( genRows )
+		# Prime the merge with each table's first data row
+		pRow = next( genRows, None )
+		if pRow:
+			strID, astrData = pRow
+			heapq.heappush( apHeap, (strID, iIn, astrData) )
+			if astrHeaders == None:
+				astrHeaders = [str(i) for i in range( len( astrData ) )]
+		aastrHeaders.append( astrHeaders or [] )
+
 	csvw = csv.writer( ostm, csv.excel_tab )
+	csvw.writerow( [strHeader] + _headers( aastrHeaders, astrLabels, fLabel ) )
+	while apHeap:
+		strID = apHeap[0][0]
+		aastrData = [None] * len( aaastrIn )
+		# Drain every row with the current ID; a later duplicate within one table wins, as in merge
+		while apHeap and ( apHeap[0][0] == strID ):
+			strCur, iIn, aastrData[iIn] = heapq.heappop( apHeap )
+			pRow = next( agenRows[iIn], None )
+			if pRow:
+				heapq.heappush( apHeap, (pRow[0], iIn, pRow[1]) )
+		astrOut = []
+		for iIn in range( len( aaastrIn ) ):
+			astrData = aastrData[iIn] or []
+			# Pad output data to correct length (possibly starting from nothing)
+			astrOut += astrData + [None] * ( len( aastrHeaders[iIn] ) - len( astrData ) )
+		csvw.writerow( [strID] + astrOut )
+
+def _spill( aastrRows ):
 	"""
-	The following is Python black magic that I dislike, but it's an extremely
-	efficient way to flatten a list.  That is, given a list of lists of strings::
+	Writes rows to a new anonymous temporary file and returns it rewound for reading.
+	"""
+
+	fileRet = tempfile.TemporaryFile( )
+	csv.writer( fileRet, csv.excel_tab ).writerows( aastrRows )
+	fileRet.seek( 0 )
+	return fileRet
+
+def _merge_runs( aiterRuns, iCol ):
+	"""
+	Merges ID-sorted row iterators into one stable ID-sorted row iterator.
+
+	Each row is decorated with its run index so that rows with equal IDs keep
+	their original relative order, which :py:func:`merge_sorted` relies upon to
+	let later duplicates win.
+	"""
+
+	def _decorate( iterRun, iRun ):
+		for astrLine in iterRun:
+			yield (astrLine[iCol], iRun, astrLine)
+	for strID, iRun, astrLine in heapq.merge( *[_decorate( aiterRuns[i], i ) for i in range( len( aiterRuns ) )] ):
+		yield astrLine
+
+def _remerge( afileRuns, iCol ):
+	"""
+	Merges consecutive run files into a single rewound run file, closing the originals.
+	"""
+
+	fileRet = _spill( _merge_runs( [csv.reader( f, csv.excel_tab ) for f in afileRuns], iCol ) )
+	for fileRun in afileRuns:
+		fileRun.close( )
+	return fileRet
+
+def sort_table( aastrIn, iCol, fHeaders, iMemory ):
+	"""
+	Yields the rows of a table stably sorted by ID using at most roughly the given memory.
+	Without headers, a header line numbering the columns of the widest row, as for
+	:py:func:`merge`, is yielded first.
 	
-		[["a", "b"], ["c"], ["d", "e", "f"]]
-		
-	it flattens their contents into a single list::
+	Rows are buffered until their estimated size exceeds ``iMemory``, at which point
+	each buffer is sorted and spilled to a temporary file as one run.  Runs are then
+	merged ``c_iMergeFanIn`` at a time, so a table of size *N* costs one write pass
+	plus one read/write pass per factor of ``c_iMergeFanIn`` in *N* / ``iMemory``.
+	A table that fits in the budget is sorted entirely in memory.
 	
-		["a", "b", "c", "d", "e", "f"]
-		
-	To parse it, read it as "the list containing every element in every list in
-	``aastrHeaders``."
+	:param	aastrIn:	Split lines from which data are read.
+	:type	aastrIn:	collection of string collections
+	:param	iCol:		Data column in which IDs are matched (zero-indexed).
+	:type	iCol:		int
+	:param	fHeaders:	If true, pass the first row through unsorted as headers.
+	:type	fHeaders:	bool
+	:param	iMemory:	Approximate number of bytes of rows to buffer before spilling.
+	:type	iMemory:	int
+	:returns:			generator of string lists -- headers, read or numbered, then sorted rows
+	
+	>>> aastrIn = [s.split( " " ) for s in ("tid exp", "c 1", "a 2", "b 3", "a 4")]
+	>>> for astrLine in sort_table( aastrIn, 0, True, 1 ):
+	...     print( " ".join( astrLine ) )
+	tid exp
+	a 2
+	a 4
+	b 3
+	c 1
 	"""
-	astrHeaders = [s for a in aastrHeaders for s in a]
-	# If we're labeling headers, prepend each with ``labelname: ``.
-	if fLabel:
-		iHeader = 0
-		for iIn in range( len( aaastrIn ) ):
-			for i in range( len( aastrHeaders[iIn] ) ):
-				astrHeaders[iHeader] = ": ".join( (re.sub( r'\.[^.]+$', "", os.path.basename( astrLabels[iIn] ) ),
-					astrHeaders[iHeader]) )
-				iHeader += 1
 
-	# Handle output differently for rows versus columns
-	if fRows:
-		astrIDs = sorted( setstrIDs )
-		# Keys go in first row rather than each row
-		csvw.writerow( [strHeader] + astrIDs )
-		iHeader = -1
-		for iIn in range( len( aaastrIn ) ):
-			aastrData, hashIDs = (a[iIn] for a in (aaastrData, ahashIDs))
-			# Look up the column numbers (if any) of all IDs in one shot
-			aiIDs = [hashIDs.get( s ) for s in astrIDs]
-			for iRow in range( len( aastrHeaders[iIn] ) ):
-				iHeader += 1
-				csvw.writerow( [astrHeaders[iHeader]] +
-					[( None if ( i == None ) else aastrData[i][iRow] ) for i in aiIDs] )
-	else:
-		csvw.writerow( [strHeader] + astrHeaders )
-		for strID in sorted( setstrIDs ):
-			astrOut = []
-			for iIn in range( len( aaastrIn ) ):
-				aastrData, hashIDs = (a[iIn] for a in (aaastrData, ahashIDs))
-				# Look up the row number of the current ID in the current dataset, if any
-				iID = hashIDs.get( strID )
-				# If not, start with no data; if yes, lift out stored data row
-				astrData = [] if ( iID == None ) else aastrData[iID]
-				# Pad output data to correct length (possibly starting from nothing)
-				astrData += [None] * ( len( aastrHeaders[iIn] ) - len( astrData ) )
-				astrOut += astrData
-			csvw.writerow( [strID] + astrOut )
+	funcID = lambda astrLine: astrLine[iCol]
+	iterIn = iter( aastrIn )
+	if fHeaders:
+		astrLine = next( iterIn, None )
+		if astrLine == None:
+			return
+		yield astrLine
+	afileRuns, aastrRun, iSize, iWidth = [], [], 0, 0
+	for astrLine in iterIn:
+		aastrRun.append( astrLine )
+		iWidth = max( iWidth, len( astrLine ) - 1 )
+		iSize += c_iRowOverhead * ( 1 + len( astrLine ) ) + sum( len( s ) for s in astrLine )
+		if iSize >= iMemory:
+			aastrRun.sort( key = funcID )
+			afileRuns.append( _spill( aastrRun ) )
+			aastrRun, iSize = [], 0
+	aastrRun.sort( key = funcID )
+	if not fHeaders:
+		yield _numbered( iWidth, iCol )
+	# Keep the final partial run in memory; it never exceeds the budget
+	if not afileRuns:
+		for astrLine in aastrRun:
+			yield astrLine
+		return
+	# Collapse consecutive runs in batches until the remainder can be merged in a single pass;
+	# keeping batches in order preserves the precedence of later duplicate IDs
+	while ( len( afileRuns ) + 1 ) > c_iMergeFanIn:
+		afileRuns = [_remerge( afileRuns[i:( i + c_iMergeFanIn )], iCol )
+			for i in range( 0, len( afileRuns ), c_iMergeFanIn )]
+	for astrLine in _merge_runs( [csv.reader( f, csv.excel_tab ) for f in afileRuns] + [aastrRun], iCol ):
+		yield astrLine
+	for fileRun in afileRuns:
+		fileRun.close( )
 
 argp = argparse.ArgumentParser( prog = "merge_tables.py",
 	description = """Performs a table join on one or more tab-delimited text files.""" )
@@ -250,12 +968,46 @@ argp.add_argument( "-c",		dest = "iCol",			metavar = "column",
 	help = "Column number (zero-indexed) from which table IDs are read" )
 argp.add_argument( "-d",		dest = "fHeaders",		action = "store_false",
 	help = "If true, assume the first row is data, not headers" )
+argp.add_argument( "-j",		dest = "iJobs",			metavar = "jobs",
+	type = int,		default = 1,
+	help = "Number of processes in which input tables are parsed" )
+argp.add_argument( "-x",		dest = "fIndex",		action = "store_true",
+	help = "If true, build and reuse a sidecar ID index next to each input table" )
+argp.add_argument( "-s",		dest = "fSorted",		action = "store_true",
+	help = "If true, assume inputs are sorted by ID and join them in one streaming pass" )
+argp.add_argument( "-m", "--max-memory",	dest = "iMemory",	metavar = "size",
+	type = sfle.bytesize,
+	help = "Externally sort inputs within this memory budget (e.g. 512M) and join them in one streaming pass" )
 __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	merge( [csv.reader( f, csv.excel_tab ) for f in args.aistms], [f.name for f in args.aistms],
-		args.fLabel, args.iCol, args.fTranspose, args.fHeaders, sys.stdout )
+	if ( args.fSorted or args.iMemory ) and args.fTranspose:
+		argp.error( "-s and -m cannot be combined with -t" )
+	if args.fIndex:
+		if args.fSorted or args.iMemory or args.fTranspose:
+			argp.error( "-x cannot be combined with -s, -m, or -t" )
+		if not all( os.path.isfile( f.name ) for f in args.aistms ):
+			argp.error( "-x requires regular file inputs" )
+	if ( args.fIndex or args.fTranspose or ( args.iJobs > 1 ) ) and not ( args.fSorted or args.iMemory ) and \
+		all( os.path.isfile( f.name ) for f in args.aistms ):
+		for f in args.aistms:
+			f.close( )
+		return merge_files( [f.name for f in args.aistms], args.fLabel, args.iCol, args.fTranspose,
+			args.fHeaders, args.iJobs, sys.stdout, args.fIndex )
+	aaastrIn, astrLabels = [csv.reader( f, csv.excel_tab ) for f in args.aistms], [f.name for f in args.aistms]
+	if args.iMemory:
+		# Split the budget so that every table's final in-memory run fits at once
+		iMemory = max( 1, args.iMemory / len( aaastrIn ) )
+		aaastrIn = [sort_table( a, args.iCol, args.fHeaders, iMemory ) for a in aaastrIn]
+	elif args.fSorted and not args.fHeaders:
+		# Numbering columns after the widest row takes a first pass over each table
+		aaastrIn = [( CReader( f ) if os.path.isfile( f.name ) else list(a) ) for f, a in zip( args.aistms, aaastrIn )]
+	if args.fSorted or args.iMemory:
+		# sort_table yields numbered headers for tables without them
+		merge_sorted( aaastrIn, astrLabels, args.fLabel, args.iCol, args.fHeaders or bool(args.iMemory), sys.stdout )
+	else:
+		merge( aaastrIn, astrLabels, args.fLabel, args.iCol, args.fTranspose, args.fHeaders, sys.stdout )
 
 if __name__ == "__main__":
 	_main( )
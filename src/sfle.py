@@ -26,16 +26,29 @@
 import collections
 import csv
 import fnmatch
+import functools
 import ftplib
 import glob
+import hashlib
 import inspect
 import logging
+import mmap
+import multiprocessing
 import os
 import re
+import shutil
+import signal
+import stat
 import subprocess
 import sys
 import threading
 import urllib
+from multiprocessing.pool import ThreadPool
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
 
 c_strDirData			= "data/"
 c_strDirDoc				= "doc/"
@@ -54,13 +67,38 @@ c_strSufR				= ".R"
 c_strSufRData			= ".RData"
 c_strSufRST				= ".rst"
 c_strSufTAR				= ".tar"
+c_strSufTMP				= ".tmp"
 c_strSufTSV				= ".tsv"
 c_strSufTXT				= ".txt"
 c_strSufXML				= ".xml"
+c_strSufXZ				= ".xz"
+c_strSufZST				= ".zst"
 
 c_strProgInlinedocsR	= "#" + c_strDirSrc + "inlinedocs.R"
 c_strProgTestthatR		= "#" + c_strDirSrc + "testthat.R"
 
+# Magic bytes, suffix, and decompressors in order of preference for each compressed format;
+# bzip2's short signature is followed by a block size digit and a block or end of stream magic
+c_aCompressions			= (
+	(r'\x1f\x8b',					c_strSufGZ,		("pigz -dc", "gzip -dc")),
+	(r'BZh[1-9](1AY&SY|\x17rE8P\x90)',	c_strSufBZ2,	("pbzip2 -dc", "lbzip2 -dc", "bzip2 -dc")),
+	(r'\xfd7zXZ\x00',				c_strSufXZ,		("xz -dc -T0",)),
+	(r'\x28\xb5\x2f\xfd',			c_strSufZST,	("zstd -dc",)),
+)
+c_iMagic				= 10
+# Python modules decompressing to standard output when no decompressor is installed
+c_hashDecompressors		= {
+	c_strSufGZ	: "import gzip, shutil, signal, sys; signal.signal( signal.SIGPIPE, signal.SIG_DFL ); "
+		"shutil.copyfileobj( gzip.open( sys.argv[1] ), sys.stdout )",
+	c_strSufBZ2	: "import bz2, shutil, signal, sys; signal.signal( signal.SIGPIPE, signal.SIG_DFL ); "
+		"shutil.copyfileobj( bz2.BZ2File( sys.argv[1] ), sys.stdout )",
+}
+c_iBufferPipe			= 1 << 20
+c_iBufferHash			= 1 << 20
+c_iCacheMax				= 100 << 30
+c_iSignatureChunk		= 64 << 20
+c_iBackfillMax			= 32
+
 c_logrSflE				= logging.getLogger( "sfle" )
 lghn = logging.StreamHandler( sys.stderr )
 lghn.setFormatter( logging.Formatter( '%(asctime)s %(levelname)10s %(module)s.%(funcName)s@%(lineno)d %(message)s' ) )
@@ -106,6 +144,81 @@ def entable( fileIn, afuncCols ):
 					break
 	return aastrRet
 
+def bytesize( pSize ):
+	"""
+	Converts a byte count or a human-readable size with optional K, M, G, or T suffix into a
+	byte count; also usable as an argparse type.
+
+	>>> [bytesize( s ) for s in (4096, "64K", "512m", "2G", "1T")]
+	[4096, 65536, 536870912, 2147483648, 1099511627776]
+	"""
+
+	if not isinstance( pSize, str ):
+		return int(pSize or 0)
+	mtch = re.search( r'^\s*(\d+)\s*([kmgt]?)b?\s*$', pSize, re.I )
+	if not mtch:
+		raise ValueError( "invalid size: %s" % pSize )
+	return int(mtch.group( 1 )) * ( 1024 ** " kmgt".index( mtch.group( 2 ).lower( ) or " " ) )
+
+def _environ( strName, funcParse, pDefault = None ):
+	"""
+	Returns an environment variable parsed by funcParse, or pDefault with a warning if it is
+	invalid, since a bad setting must not stop sfle from importing.
+	"""
+
+	strValue = os.environ.get( strName )
+	if strValue == None:
+		return pDefault
+	try:
+		return funcParse( strValue )
+	except ValueError:
+		c_logrSflE.warning( "Ignoring invalid $%s: %s" % (strName, strValue) )
+		return pDefault
+
+def mapfile( fileIn ):
+	"""
+	Returns a read-only memory map of a regular, non-empty file, or None if it cannot be mapped.
+	"""
+
+	try:
+		if not ( stat.S_ISREG( os.fstat( fileIn.fileno( ) ).st_mode ) and os.fstat( fileIn.fileno( ) ).st_size ):
+			return None
+		return mmap.mmap( fileIn.fileno( ), 0, access = mmap.ACCESS_READ )
+	except (AttributeError, EnvironmentError, ValueError):
+		return None
+
+def maplines( pIn, iBegin, iEnd ):
+	"""
+	Yields the raw lines (with newlines) of a string or memory map between two byte offsets.
+
+	>>> list( maplines( "a\\nbb\\nccc", 2, 9 ) )
+	['bb\\n', 'ccc']
+	"""
+
+	while iBegin < iEnd:
+		iNext = pIn.find( "\n", iBegin, iEnd ) + 1 or iEnd
+		yield pIn[iBegin:iNext]
+		iBegin = iNext
+
+def mapranges( pIn, iRanges ):
+	"""
+	Splits a string or memory map into up to iRanges newline-aligned (begin, end) byte ranges.
+
+	>>> mapranges( "a\\nbb\\nccc\\nd", 3 )
+	[(0, 5), (5, 9), (9, 10)]
+	"""
+
+	aiRet = []
+	iBegin, iSize = 0, len( pIn )
+	for i in range( 1, iRanges + 1 ):
+		iEnd = ( iSize * i ) / iRanges
+		if iEnd < iSize:
+			iEnd = pIn.find( "\n", max( iBegin, iEnd - 1 ) ) + 1 or iSize
+		if iEnd > iBegin:
+			aiRet.append( (iBegin, iEnd) )
+			iBegin = iEnd
+	return aiRet
+
 def readcomment( fileIn ):
 	
 	if not isinstance( fileIn, file ):
@@ -255,21 +368,23 @@ def ex( pCmd, strOut = None, strErr = None ):
 	sys.stdout.write( ( ( " 2> %s" % quote( strErr ) ) if strErr else "" ) + "\n" )
 	if not ( strOut or strErr ):
 		return subprocess.call( strCmd, shell = True )
-	pProc = subprocess.Popen( strCmd, shell = True,
-		stdout = ( subprocess.PIPE if strOut else None ),
-		stderr = ( open( strErr, "w" ) if strErr else None ) )
-	if not pProc:
-		return 1
-	if strOut:
-		strLine = pProc.stdout.readline( )
-		if not strLine:
-			pProc.communicate( )
-			return pProc.wait( )
-		with open( strOut, "w" ) as fileOut:
-			fileOut.write( strLine )
-			for strLine in pProc.stdout:
-				fileOut.write( strLine )
-	return pProc.wait( )
+	# The child writes straight to a temporary file beside the target, so output never passes
+	# through this process; empty output leaves no target behind, as SCons expects on failure
+	strTmp = ( strOut + c_strSufTMP ) if strOut else None
+	fileOut = open( strTmp, "wb" ) if strOut else None
+	fileErr = open( strErr, "w" ) if strErr else None
+	try:
+		iRet = subprocess.call( strCmd, shell = True, stdout = fileOut, stderr = fileErr )
+	finally:
+		for file in (fileOut, fileErr):
+			if file:
+				file.close( )
+	if strTmp:
+		if os.path.getsize( strTmp ):
+			os.rename( strTmp, strOut )
+		else:
+			os.unlink( strTmp )
+	return iRet
 
 def ts( afileTargets, afileSources ):
 
@@ -295,6 +410,413 @@ def override( pE, pFile ):
 	pFile.implicit_set = set()
 	pFile.env = None
 
+#===============================================================================
+# Persistent file signatures
+#===============================================================================
+
+_hashSignatures = {"file" : os.environ.get( "SFLE_SIGNATURES" ), "sigs" : None}
+_lockSignatures = threading.Lock( )
+
+def signatures( strFile ):
+	"""
+	Sets the sidecar file in which file signatures persist between builds, keyed on device,
+	inode, size, and modification time.  Child builds inherit it through $SFLE_SIGNATURES,
+	so subprojects sharing inputs hash each of them only once.  Only the latest signature
+	of each file is kept when the sidecar is next loaded.
+
+	>>> import tempfile
+	>>> strTmp = tempfile.mkdtemp( )
+	>>> strData, strSigs = (os.path.join( strTmp, s ) for s in ("data.txt", "sigs"))
+	>>> signatures( strSigs )
+	>>> for strText in ("a", "ab"):
+	...     with open( strData, "w" ) as fileOut:
+	...         fileOut.write( strText )
+	...     strSig = signature( strData )
+	>>> len( open( strSigs ).readlines( ) )
+	2
+	>>> signatures( strSigs )
+	>>> signature( strData ) == strSig, len( open( strSigs ).readlines( ) )
+	(True, 1)
+	>>> signatures( None )
+	>>> shutil.rmtree( strTmp )
+	"""
+
+	_hashSignatures["file"], _hashSignatures["sigs"] = strFile, None
+	if strFile:
+		os.environ["SFLE_SIGNATURES"] = strFile
+	else:
+		os.environ.pop( "SFLE_SIGNATURES", None )
+
+def _hashchunk( aArgs ):
+
+	strFile, iBegin, iEnd = aArgs
+	hashRet = xxhash.xxh64( ) if xxhash else hashlib.md5( )
+	with open( strFile, "rb" ) as fileIn:
+		fileIn.seek( iBegin )
+		while iBegin < iEnd:
+			strBlock = fileIn.read( min( c_iBufferHash, iEnd - iBegin ) )
+			if not strBlock:
+				break
+			hashRet.update( strBlock )
+			iBegin += len( strBlock )
+	return hashRet.hexdigest( )
+
+def hashfile( strFile, iSize = None ):
+	"""
+	Hashes a file's contents with xxHash if installed or MD5 otherwise.  Files larger than
+	one chunk are hashed chunk by chunk in parallel threads and the chunk digests combined.
+	"""
+
+	if iSize == None:
+		iSize = os.path.getsize( strFile )
+	aaArgs = [(strFile, i, min( iSize, i + c_iSignatureChunk )) for i in range( 0, iSize, c_iSignatureChunk )]
+	if len( aaArgs ) < 2:
+		return _hashchunk( (strFile, 0, iSize) )
+	pPool = ThreadPool( min( len( aaArgs ), multiprocessing.cpu_count( ) ) )
+	try:
+		astrChunks = pPool.map( _hashchunk, aaArgs )
+	finally:
+		pPool.close( )
+	return hashlib.md5( " ".join( astrChunks ) ).hexdigest( )
+
+def _signatures_load( ):
+
+	if _hashSignatures["sigs"] == None:
+		hashSigs = {}
+		# Device and inode identify a file, so a later line for one supersedes earlier ones
+		hashFiles = {}
+		iLines = 0
+		strFile = _hashSignatures["file"]
+		if strFile and os.path.exists( strFile ):
+			with open( strFile ) as fileIn:
+				for strLine in fileIn:
+					iLines += 1
+					astrLine = strLine.rstrip( "\n" ).rsplit( "\t", 1 )
+					if len( astrLine ) == 2:
+						strFileKey = "\t".join( astrLine[0].split( "\t" )[:2] )
+						hashSigs.pop( hashFiles.get( strFileKey ), None )
+						hashFiles[strFileKey] = astrLine[0]
+						hashSigs[astrLine[0]] = astrLine[1]
+		if len( hashSigs ) < iLines:
+			_signatures_compact( strFile, hashSigs )
+		_hashSignatures["sigs"] = hashSigs
+	return _hashSignatures["sigs"]
+
+def _signatures_compact( strFile, hashSigs ):
+	"""
+	Atomically rewrites the signature sidecar without superseded lines; failure only leaves it longer.
+	"""
+
+	strTmp = "%s.%d" % (strFile, os.getpid( ))
+	try:
+		with open( strTmp, "w" ) as fileOut:
+			for strKey, strSig in hashSigs.iteritems( ):
+				fileOut.write( "%s\t%s\n" % (strKey, strSig) )
+		os.rename( strTmp, strFile )
+	except (IOError, OSError):
+		if os.path.exists( strTmp ):
+			os.remove( strTmp )
+
+def signature( strFile ):
+	"""
+	Returns the content hash of a file, reusing the hash recorded for the same device, inode,
+	size, and modification time when one exists.
+	"""
+
+	pStat = os.stat( strFile )
+	iTime = getattr( pStat, "st_mtime_ns", None ) or int(pStat.st_mtime * 1e9)
+	strKey = "\t".join( str(p) for p in (pStat.st_dev, pStat.st_ino, pStat.st_size, iTime) )
+	with _lockSignatures:
+		strRet = _signatures_load( ).get( strKey )
+	if strRet == None:
+		strRet = hashfile( strFile, pStat.st_size )
+		with _lockSignatures:
+			_hashSignatures["sigs"][strKey] = strRet
+			if _hashSignatures["file"]:
+				# Appended lines are written whole, so concurrent builds can share the sidecar
+				with open( _hashSignatures["file"], "a" ) as fileOut:
+					fileOut.write( "%s\t%s\n" % (strKey, strRet) )
+	return strRet
+
+def decider( dependency, target, prev_ni, *aArgs ):
+	"""
+	SCons decider that compares files by their persisted signatures, which also become the
+	content signatures SCons records, so unchanged large inputs are never rehashed.
+	"""
+
+	strFile = dependency.get_abspath( ) if ( "get_abspath" in dir( dependency ) ) else None
+	if not ( strFile and os.path.isfile( strFile ) ):
+		return dependency.changed_content( target, prev_ni, *aArgs )
+	strSig = signature( strFile )
+	dependency.get_ninfo( ).csig = strSig
+	return ( getattr( prev_ni, "csig", None ) != strSig )
+
+#===============================================================================
+# Shared artifact cache
+#===============================================================================
+
+_hashCache = {"dir" : os.environ.get( "SFLE_CACHE" ),
+	"max" : _environ( "SFLE_CACHE_MAX", bytesize, c_iCacheMax ), "pending" : None}
+
+def cache( strDir, iMax = c_iCacheMax ):
+	"""
+	Enables (or, given None, disables) a content-addressed cache of pipeline outputs shared
+	by every build that points at the same directory.  Entries beyond iMax total bytes (a
+	count or a size such as "10G") are evicted least recently used first, checked after
+	every sixteenth of iMax stored.  Defaults come from $SFLE_CACHE and $SFLE_CACHE_MAX.
+	"""
+
+	_hashCache["dir"], _hashCache["max"], _hashCache["pending"] = strDir, bytesize( iMax ), None
+
+def _cachekey( strCmd, astrTs, astrSs, astrArgs, fTo, fErr ):
+	"""
+	Hashes what determines a pipeline step's outputs: its command, the contents of its
+	sources, and its rendered arguments with file paths replaced by their positions, so
+	identical steps match across checkouts.
+
+	>>> strA = _cachekey( "sort", ["/a/out"], [], ["-k", quote( "/a/out" )], True, False )
+	>>> strA == _cachekey( "sort", ["/b/out"], [], ["-k", quote( "/b/out" )], True, False )
+	True
+	>>> strA == _cachekey( "sort", ["/a/out"], [], ["-n", quote( "/a/out" )], True, False )
+	False
+	"""
+
+	hashPaths = dict( (quote( s ), "out:%d" % i) for i, s in enumerate( astrTs ) )
+	hashPaths.update( (quote( s ), "in:%d" % i) for i, s in enumerate( astrSs ) )
+	hashRet = hashlib.sha1( )
+	for pKey in [strCmd, fTo, fErr, len( astrTs )] + [signature( s ) for s in astrSs] + \
+		[hashPaths.get( s, s ) for s in astrArgs]:
+		hashRet.update( "%s\0" % pKey )
+	return hashRet.hexdigest( )
+
+def _cachedir( strKey ):
+
+	return os.path.join( _hashCache["dir"], strKey[:2], strKey )
+
+def _restore( strKey, astrTs ):
+	"""
+	Copies a cached step's outputs into place, returning False if the entry is missing or
+	disappears part way, e.g. when another build evicts it, so the step is simply run.
+	"""
+
+	strDir = _cachedir( strKey )
+	if not os.path.isdir( strDir ):
+		return False
+	astrTmps = []
+	try:
+		for i, strT in enumerate( astrTs ):
+			# Targets are private copies, so writing to them never reaches the shared entry
+			strTmp = strT + c_strSufTMP
+			astrTmps.append( strTmp )
+			shutil.copyfile( os.path.join( strDir, str(i) ), strTmp )
+		for strTmp, strT in zip( astrTmps, astrTs ):
+			os.rename( strTmp, strT )
+		os.utime( strDir, None )
+	except EnvironmentError:
+		for strTmp in astrTmps:
+			if os.path.exists( strTmp ):
+				os.unlink( strTmp )
+		return False
+	return True
+
+def _store( strKey, astrTs ):
+
+	strDir = _cachedir( strKey )
+	if os.path.isdir( strDir ) or not all( os.path.isfile( s ) for s in astrTs ):
+		return False
+	strTmp = "%s.%d%s" % (strDir, os.getpid( ), c_strSufTMP)
+	try:
+		os.makedirs( strTmp )
+		for i, strT in enumerate( astrTs ):
+			strTo = os.path.join( strTmp, str(i) )
+			shutil.copyfile( strT, strTo )
+			os.chmod( strTo, 0444 )
+		os.rename( strTmp, strDir )
+	except EnvironmentError:
+		# Another build stored the same step first, or the cache is unwritable
+		shutil.rmtree( strTmp, True )
+		return False
+	# Walking the whole cache is amortized over stores adding a sixteenth of its bound
+	iSize = sum( os.path.getsize( s ) for s in astrTs )
+	if ( _hashCache["pending"] == None ) or ( ( _hashCache["pending"] + iSize ) > ( _hashCache["max"] >> 4 ) ):
+		_evict( )
+		_hashCache["pending"] = 0
+	else:
+		_hashCache["pending"] += iSize
+	return True
+
+def _evict( ):
+
+	aaEntries = []
+	iTotal = 0
+	for strPrefix in os.listdir( _hashCache["dir"] ):
+		strPrefix = os.path.join( _hashCache["dir"], strPrefix )
+		for strDir in glob.glob( os.path.join( strPrefix, "*" ) ):
+			if strDir.endswith( c_strSufTMP ):
+				continue
+			try:
+				iSize = sum( os.path.getsize( os.path.join( strDir, s ) ) for s in os.listdir( strDir ) )
+				aaEntries.append( (os.path.getmtime( strDir ), iSize, strDir) )
+			except OSError:
+				# Evicted concurrently by another build
+				continue
+			iTotal += iSize
+	for dTime, iSize, strDir in sorted( aaEntries ):
+		if iTotal <= _hashCache["max"]:
+			break
+		shutil.rmtree( strDir, True )
+		iTotal -= iSize
+
+def _cached( strCmd, astrTs, astrSs, astrArgs, strTo, strErr, funcBuild ):
+	"""
+	Restores a pipeline step's outputs from the shared cache, or builds and then caches
+	them.  Entries are read-only copies and are copied back out, so no workspace file ever
+	shares storage with the cache.  Steps without outputs are always run.
+	"""
+
+	if not ( _hashCache["dir"] and astrTs ):
+		return funcBuild( )
+	strKey = _cachekey( strCmd, astrTs, astrSs, astrArgs, bool(strTo), bool(strErr) )
+	if _restore( strKey, astrTs ):
+		sys.stdout.write( "Restored from cache: %s\n" % " ".join( quote( s ) for s in astrTs ) )
+		return 0
+	iRet = funcBuild( )
+	if not iRet:
+		_store( strKey, astrTs )
+	return iRet
+
+#===============================================================================
+# Resource-aware scheduling
+#===============================================================================
+
+class CResources:
+	"""
+	Budget of cores and memory shared by the stages of a build.  Each stage reserves what it
+	declared before running and waits until that much is free.  Waiting stages are served in
+	arrival order, but a later stage that fits may run ahead of earlier ones, so light stages
+	fill cores left idle while a heavy stage waits for room.  Once a waiting stage has been
+	passed c_iBackfillMax times, no later stage may pass it, so heavy stages cannot starve.
+	Requests beyond the whole budget are clamped to it.  The budget defaults to the whole
+	machine, or to $SFLE_CORES and $SFLE_MEMORY, which child builds receive as their share.
+
+	>>> pResources = CResources( 4, "8G" )
+	>>> pResources.reserve( 3, "6G" )
+	(3, 6442450944)
+	>>> pResources.free( )
+	(1, 2147483648)
+	>>> pResources.reserve( 16, 0, False )
+	Traceback (most recent call last):
+	...
+	RuntimeError: reservation would wait
+	"""
+
+	def __init__( self, iCores = None, pMemory = None ):
+
+		if pMemory == None:
+			pMemory = _environ( "SFLE_MEMORY", bytesize )
+		if pMemory == None:
+			try:
+				pMemory = os.sysconf( "SC_PAGE_SIZE" ) * os.sysconf( "SC_PHYS_PAGES" )
+			except (AttributeError, ValueError, OSError):
+				pMemory = 0
+		self.m_iCores = iCores or _environ( "SFLE_CORES", int ) or multiprocessing.cpu_count( )
+		self.m_iMemory = bytesize( pMemory )
+		self.m_iCoresFree, self.m_iMemoryFree = self.m_iCores, self.m_iMemory
+		self.m_pCondition = threading.Condition( )
+		self.m_aaWaiting = []
+		"""Waiting requests in arrival order, as [cores, memory, times passed]."""
+
+	def free( self ):
+
+		return (self.m_iCoresFree, self.m_iMemoryFree)
+
+	def _fits( self, aRequest ):
+
+		return ( ( aRequest[0] <= self.m_iCoresFree ) and ( aRequest[1] <= self.m_iMemoryFree ) )
+
+	def _ready( self, aRequest ):
+
+		if not self._fits( aRequest ):
+			return False
+		for aWaiting in self.m_aaWaiting:
+			if aWaiting is aRequest:
+				return True
+			# Earlier requests that fit go first, and old ones hold back everything behind them
+			if ( aWaiting[2] >= c_iBackfillMax ) or self._fits( aWaiting ):
+				return False
+		return True
+
+	def reserve( self, iCores = 1, pMemory = 0, fWait = True ):
+
+		iCores = max( 0, min( self.m_iCores, iCores ) )
+		# An unknown machine memory size disables the memory budget
+		iMemory = min( self.m_iMemory, bytesize( pMemory ) ) if self.m_iMemory else 0
+		aRequest = [iCores, iMemory, 0]
+		with self.m_pCondition:
+			self.m_aaWaiting.append( aRequest )
+			while not self._ready( aRequest ):
+				if not fWait:
+					self.m_aaWaiting.remove( aRequest )
+					raise RuntimeError( "reservation would wait" )
+				self.m_pCondition.wait( )
+			iRequest = self.m_aaWaiting.index( aRequest )
+			for aWaiting in self.m_aaWaiting[:iRequest]:
+				aWaiting[2] += 1
+			del self.m_aaWaiting[iRequest]
+			self.m_iCoresFree -= iCores
+			self.m_iMemoryFree -= iMemory
+			self.m_pCondition.notify_all( )
+		return (iCores, iMemory)
+
+	def release( self, aReservation ):
+
+		iCores, iMemory = aReservation
+		with self.m_pCondition:
+			self.m_iCoresFree += iCores
+			self.m_iMemoryFree += iMemory
+			self.m_pCondition.notify_all( )
+
+	def share( self, iShares ):
+		"""
+		Returns environment variables giving a child build one of iShares equal parts of
+		this budget, so concurrent recursive builds together stay within it.
+
+		>>> sorted( CResources( 8, "8G" ).share( 3 ).items( ) )
+		[('SFLE_CORES', '2'), ('SFLE_MEMORY', '2863311530')]
+		"""
+
+		iShares = max( 1, iShares )
+		hashRet = {"SFLE_CORES" : str(max( 1, self.m_iCores / iShares ))}
+		if self.m_iMemory:
+			hashRet["SFLE_MEMORY"] = str(self.m_iMemory / iShares)
+		return hashRet
+
+_hashResources = {"budget" : CResources( )}
+
+def resources( iCores = None, pMemory = None ):
+	"""
+	Sets the cores and memory available to the stages of this build, by default the whole
+	machine.  Every waiting stage holds one of scons' -j worker threads, so run scons with
+	more jobs than cores, e.g. twice as many, leaving threads free for stages that fit.
+	"""
+
+	_hashResources["budget"] = CResources( iCores, pMemory )
+
+def reserved( funcAction, iCores = 1, pMemory = 0 ):
+	"""
+	Wraps an SCons action so that it runs only once the declared cores and memory are free.
+	"""
+
+	@functools.wraps( funcAction )
+	def funcRet( target, source, env ):
+		pBudget = _hashResources["budget"]
+		aReservation = pBudget.reserve( iCores, pMemory )
+		try:
+			return funcAction( target, source, env )
+		finally:
+			pBudget.release( aReservation )
+	return funcRet
+
 #===============================================================================
 # Command execution
 #===============================================================================
@@ -333,9 +855,166 @@ def quote( p ):
 
 	return ( "\"" + str(p) + "\"" )
 
+def compression( strFile ):
+	"""
+	Returns the magic bytes, suffix, and decompressors of a compressed file's format,
+	recognized by its leading bytes or, if it cannot be read yet, by its suffix.
+
+	>>> compression( "missing.bz2" )[1]
+	'.bz2'
+	>>> compression( "missing.txt" )
+	>>> import tempfile
+	>>> strTmp = tempfile.mkdtemp( )
+	>>> with open( os.path.join( strTmp, "bzh.txt" ), "w" ) as fileOut:
+	...     fileOut.write( "BZh is only text\\n" )
+	>>> compression( os.path.join( strTmp, "bzh.txt" ) )
+	>>> cat( os.path.join( strTmp, "bzh.txt" ) ).split( )[0]
+	'cat'
+	>>> import bz2
+	>>> with open( os.path.join( strTmp, "t.bz2" ), "wb" ) as fileOut:
+	...     fileOut.write( bz2.compress( "BZh is only text\\n" ) )
+	>>> compression( os.path.join( strTmp, "t.bz2" ) )[1]
+	'.bz2'
+	>>> shutil.rmtree( strTmp )
+	"""
+
+	try:
+		with open( strFile, "rb" ) as fileIn:
+			strMagic = fileIn.read( c_iMagic )
+	except (IOError, OSError):
+		strMagic = None
+	for aCompression in c_aCompressions:
+		strMagicCur, strSuffix = aCompression[:2]
+		if ( re.match( strMagicCur, strMagic ) if ( strMagic != None ) else strFile.endswith( strSuffix ) ):
+			return aCompression
+	return None
+
+_hashWhich = {}
+def which( strProg ):
+
+	if strProg not in _hashWhich:
+		_hashWhich[strProg] = None
+		for strDir in os.environ.get( "PATH", "" ).split( os.pathsep ):
+			strPath = os.path.join( strDir, strProg )
+			if os.path.isfile( strPath ) and os.access( strPath, os.X_OK ):
+				_hashWhich[strProg] = strPath
+				break
+	return _hashWhich[strProg]
+
+def decompressor( strFile ):
+	"""
+	Returns the preferred installed command that decompresses a file to standard output,
+	favoring parallel decompressors, or None if the file is not compressed.
+	"""
+
+	aCompression = compression( strFile )
+	if not aCompression:
+		return None
+	astrCmds = aCompression[2]
+	for strCmd in astrCmds:
+		if which( strCmd.split( )[0] ):
+			return strCmd
+	return astrCmds[-1]
+
 def cat( strFrom ):
 	
-	return " ".join( (( "gunzip -c" if re.search( r'\.gz$', strFrom ) else "cat" ), quote( strFrom )) )
+	return " ".join( (( decompressor( strFrom ) or "cat" ), quote( strFrom )) )
+
+class CDecompressed:
+	"""
+	Read-only file over a decompressor child process.  The child is reaped at end of file or
+	on close, and a failure such as truncated input raises IOError there, as Python's own
+	gzip and bz2 readers do, rather than passing partial data on silently.  Its fileno is
+	the child's output pipe, so it can be handed to another process as standard input.
+	"""
+
+	def __init__( self, astrCmd ):
+
+		self.m_astrCmd = astrCmd
+		# Python ignores SIGPIPE, which children would inherit and report as a write error
+		self.m_pProc = subprocess.Popen( astrCmd, stdout = subprocess.PIPE, bufsize = c_iBufferPipe,
+			preexec_fn = lambda: signal.signal( signal.SIGPIPE, signal.SIG_DFL ) )
+		self.m_fDone = False
+
+	def _done( self ):
+
+		if self.m_fDone:
+			return
+		self.m_fDone = True
+		self.m_pProc.stdout.close( )
+		iRet = self.m_pProc.wait( )
+		# Closing early, here or in a reader such as head, ends the child with SIGPIPE
+		if iRet and ( iRet != -signal.SIGPIPE ):
+			raise IOError( "%s exited with status %d" % (" ".join( self.m_astrCmd ), iRet) )
+
+	def read( self, iSize = -1 ):
+
+		strRet = self.m_pProc.stdout.read( iSize )
+		if ( iSize < 0 ) or not strRet:
+			self._done( )
+		return strRet
+
+	def readline( self ):
+
+		strRet = self.m_pProc.stdout.readline( )
+		if not strRet:
+			self._done( )
+		return strRet
+
+	def __iter__( self ):
+
+		return self
+
+	def next( self ):
+
+		strRet = self.readline( )
+		if not strRet:
+			raise StopIteration
+		return strRet
+
+	def fileno( self ):
+
+		return self.m_pProc.stdout.fileno( )
+
+	def close( self ):
+
+		self._done( )
+
+	def __enter__( self ):
+
+		return self
+
+	def __exit__( self, *aArgs ):
+
+		self.close( )
+
+def zopen( strFile ):
+	"""
+	Opens a possibly compressed file for reading.  Compressed data are decompressed by the
+	preferred installed decompressor in a child process, falling back to a Python child
+	using the gzip or bz2 module when no decompressor is installed, so the result always
+	has a real file descriptor.
+
+	>>> import gzip, tempfile
+	>>> strTmp = tempfile.mkdtemp( )
+	>>> strFile = os.path.join( strTmp, "t.gz" )
+	>>> with gzip.open( strFile, "wb" ) as fileOut:
+	...     iLen = fileOut.write( "a\\nb\\n" )
+	>>> with zopen( strFile ) as fileIn:
+	...     subprocess.check_output( ["wc", "-l"], stdin = fileIn ).strip( )
+	'2'
+	>>> shutil.rmtree( strTmp )
+	"""
+
+	aCompression = compression( strFile )
+	if not aCompression:
+		return open( strFile )
+	strCmd = decompressor( strFile )
+	if which( strCmd.split( )[0] ):
+		return CDecompressed( strCmd.split( ) + [strFile] )
+	if aCompression[1] in c_hashDecompressors:
+		return CDecompressed( [sys.executable, "-c", c_hashDecompressors[aCompression[1]], strFile] )
+	raise IOError( "No decompressor found for: %s" % strFile )
 
 def _pipeargs( strFrom, strTo, aArgs, strErr ):
 
@@ -355,44 +1034,47 @@ def _pipeargs( strFrom, strTo, aArgs, strErr ):
 		astrOuts.append( strErr )
 	return ( [_pipefile( s ) for s in (strFrom, strTo, strErr)] + [astrIns, astrOuts, astrArgs] )
 
-def pipe( pE, strFrom, strProg, strTo, aArgs = [], strErr = None ):
+def pipe( pE, strFrom, strProg, strTo, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 	
 	strFrom, strTo, strErr, astrIns, astrOuts, astrArgs = _pipeargs( strFrom, strTo, aArgs, strErr )
 	def funcPipe( target, source, env, strTo = strTo, strFrom = strFrom, astrArgs = astrArgs, strErr = strErr ):
 		astrTs, astrSs = tss( target, source )
-		return ex( ( [cat( strFrom ), "|"] if strFrom else [] ) + [astrSs[0]] + astrArgs, strTo, strErr )
-	return pE.Command( astrOuts, [strProg] + astrIns, funcPipe )
+		return _cached( "", astrTs, astrSs, astrArgs, strTo, strErr, lambda:
+			ex( ( [cat( strFrom ), "|"] if strFrom else [] ) + [astrSs[0]] + astrArgs, strTo, strErr ) )
+	return pE.Command( astrOuts, [strProg] + astrIns, reserved( funcPipe, iCores, pMemory ) )
 
-def cmd( pE, strProg, strTo, aArgs = [], strErr = None ):
+def cmd( pE, strProg, strTo, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return pipe( pE, None, strProg, strTo, aArgs, strErr )
+	return pipe( pE, None, strProg, strTo, aArgs, strErr, iCores, pMemory )
 
-def sink( pE, strFrom, strProg, aArgs = [], strErr = None ):
+def sink( pE, strFrom, strProg, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return pipe( pE, strFrom, strProg, None, aArgs, strErr )
+	return pipe( pE, strFrom, strProg, None, aArgs, strErr, iCores, pMemory )
 
-def op( pE, strProg, aArgs = [], strErr = None ):
+def op( pE, strProg, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return pipe( pE, None, strProg, None, aArgs, strErr )
+	return pipe( pE, None, strProg, None, aArgs, strErr, iCores, pMemory )
 
-def spipe( pE, strFrom, strCmd, strTo, aArgs = [], strErr = None ):
+def spipe( pE, strFrom, strCmd, strTo, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 	
 	strFrom, strTo, strErr, astrIns, astrOuts, astrArgs = _pipeargs( strFrom, strTo, aArgs, strErr )
 	def funcPipe( target, source, env, strCmd = strCmd, strTo = strTo, strFrom = strFrom, astrArgs = astrArgs, strErr = strErr ):
-		return ex( ( [cat( strFrom ), "|"] if strFrom else [] ) + [strCmd] + astrArgs, strTo, strErr )
-	return pE.Command( astrOuts, astrIns, funcPipe )
+		astrTs, astrSs = tss( target, source )
+		return _cached( strCmd, astrTs, astrSs, astrArgs, strTo, strErr, lambda:
+			ex( ( [cat( strFrom ), "|"] if strFrom else [] ) + [strCmd] + astrArgs, strTo, strErr ) )
+	return pE.Command( astrOuts, astrIns, reserved( funcPipe, iCores, pMemory ) )
 
-def scmd( pE, strCmd, strTo, aArgs = [], strErr = None ):
+def scmd( pE, strCmd, strTo, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return spipe( pE, None, strCmd, strTo, aArgs, strErr )
+	return spipe( pE, None, strCmd, strTo, aArgs, strErr, iCores, pMemory )
 
-def ssink( pE, strFrom, strCmd, aArgs = [], strErr = None ):
+def ssink( pE, strFrom, strCmd, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return spipe( pE, strFrom, strCmd, None, aArgs, strErr )
+	return spipe( pE, strFrom, strCmd, None, aArgs, strErr, iCores, pMemory )
 
-def sop( pE, strCmd, aArgs = [], strErr = None ):
+def sop( pE, strCmd, aArgs = [], strErr = None, iCores = 1, pMemory = 0 ):
 
-	return spipe( pE, None, strCmd, None, aArgs, strErr )
+	return spipe( pE, None, strCmd, None, aArgs, strErr, iCores, pMemory )
 
 #===============================================================================
 # Sphinx reporting utilities
@@ -456,22 +1138,44 @@ def rst_subsubsection( strTitle, ostm ):
 	
 	return _rst_section( strTitle, ostm, "~" )
 
-def rst_table( aaTable, ostm, fHeader = True ):
+def rst_table( aaTable, ostm, fHeader = True, iWidth = None ):
+	"""
+	Writes an RST simple table.  If the column width is given, rows are consumed once in
+	order and may be any iterable, e.g. a reader over rows spooled to disk.
+
+	>>> rst_table( iter( [["a", "b"], [1, 22]] ), sys.stdout, True, 2 ) #doctest: +NORMALIZE_WHITESPACE
+	==  ==
+	a   b
+	==  ==
+	1   22
+	==  ==
+	<BLANKLINE>
+	True
+	"""
 
-	if not ( aaTable and aaTable[0] ):
+	if iWidth == None:
+		if not ( aaTable and aaTable[0] ):
+			return False
+		iWidth = max( (max( (len( str(p) ) for p in a) ) for a in aaTable) )
+
+	def _row( aOutput ):
+		ostm.write( "%s\n" % "  ".join( str(p).ljust( iWidth ) for p in aOutput ) )
+
+	astrHeader = None
+	for aRow in aaTable:
+		if astrHeader:
+			_row( aRow )
+			continue
+		if not aRow:
+			return False
+		astrHeader = ["=" * iWidth] * len( aRow )
+		_row( astrHeader )
+		_row( aRow )
+		if fHeader:
+			_row( astrHeader )
+	if not astrHeader:
 		return False
-	
-	iWidth = max( (max( (len( str(p) ) for p in a) ) for a in aaTable) )
-	astrHeader = ["=" * iWidth] * len( aaTable[0] )
-	aaOutput = [astrHeader] + [a for a in aaTable] + [astrHeader]
-	if fHeader:
-		aaOutput.insert( 2, astrHeader )
-	for aOutput in aaOutput:
-		astrOutput = [str(p) for p in aOutput]
-		for i in range( len( astrOutput ) ):
-			if len(astrOutput[i]) < iWidth:
-				astrOutput[i] += " " * ( iWidth - len(astrOutput[i]) )
-		ostm.write( "%s\n" % "  ".join( astrOutput ) )
+	_row( astrHeader )
 	ostm.write( "\n" )
 	return True
 
@@ -559,28 +1263,220 @@ def testthat( pE, fileProg, fileDir, fileOut ):
 # SConstruct helper functions
 #===============================================================================
 
-def scons_child( pE, fileDir, hashArgs = None, fileSConstruct = None, afileDeps = None ):
+_hashChildren = {"unified" : ( os.environ.get( "SFLE_UNIFIED", "" ).lower( ) not in ("", "0", "false") )}
+
+# Recursive child builds declared so far, which share scons' -j and the resources() budget
+_hashRecursive = {"children" : 0}
 
-	def funcTmp( target, source, env, fileDir = fileDir, fileSConstruct = fileSConstruct ):
-		strDir, strSConstruct = (( ( os.path.abspath( f ) if ( type( f ) == str ) else f.get_abspath( ) ) if f else None )
-			for f in (fileDir, fileSConstruct))
+def unified( fUnified ):
+	"""
+	Selects whether child projects found at configuration time are read into the parent's
+	dependency graph, where one scheduler and one -j limit cover every project, rather than
+	built by a recursive scons process each.  The default comes from $SFLE_UNIFIED, where any
+	value other than empty, 0, or false enables it.
+
+	Unified children's actions run in the parent's directory, so their command lines must
+	name files through $TARGET, $SOURCE, or absolute paths; a command naming one of the
+	child's files by a path relative to the child's directory is rejected.
+	"""
+
+	_hashChildren["unified"] = fUnified
+
+def _scons_child_setup( strDir, strSConstruct, hashArgs ):
+
+	try:
+		os.makedirs( strDir )
+	except os.error:
+		pass
+	if strSConstruct:
+		subprocess.call( ["ln", "-f", "-s", strSConstruct, d( strDir, "SConstruct" )] )
+	if hashArgs:
+		with open( d( strDir, "SConscript" ), "w" ) as fileOut:
+			fileOut.write( "hashArgs = {\n" )
+			for strKey, strValue in hashArgs.items( ):
+				fileOut.write( "	\"%s\"	: %s,\n" % (strKey, repr( strValue )) )
+			fileOut.write( "}\nExport( \"hashArgs\" )\n" )
+
+def _scons_child_read( pE, strDir, hashArgs ):
+	"""
+	Reads a child's SConstruct into the parent's graph as if it were a separate build: its
+	DefaultEnvironment, Decider, and Default calls and its sfle settings apply to a fresh
+	default environment and are undone afterwards, leaving the parent's as they were.
+	Returns the child's default targets.
+	"""
+	import SCons.Defaults
+	import SCons.Script
+	# SCons.Script.SConscript names the global function, not its module
+	pSConscript = sys.modules["SCons.Script.SConscript"]
+
+	aState = (SCons.Defaults._default_env, pSConscript._DefaultEnvironmentProxy,
+		SCons.Script._Get_Default_Targets, list(SCons.Script.DEFAULT_TARGETS),
+		list(SCons.Script.BUILD_TARGETS), list(SCons.Script._build_plus_default))
+	ahashState = [dict(h) for h in (_hashSignatures, _hashCache, _hashResources, _hashChildren)]
+	hashEnviron = dict(os.environ)
+	SCons.Defaults._default_env = pSConscript._DefaultEnvironmentProxy = None
+	try:
+		# Paths in the child's SConstruct resolve against its own directory, as in a recursive build
+		pE.SConscript( d( strDir, "SConstruct" ), exports = ( {"hashArgs" : hashArgs} if hashArgs else [] ) )
+		afileRet = [p for p in SCons.Script.DEFAULT_TARGETS if p not in aState[3]]
+	finally:
+		SCons.Defaults._default_env, pSConscript._DefaultEnvironmentProxy, \
+			SCons.Script._Get_Default_Targets = aState[:3]
+		for aCur, aOld in zip( (SCons.Script.DEFAULT_TARGETS, SCons.Script.BUILD_TARGETS,
+			SCons.Script._build_plus_default), aState[3:] ):
+			aCur[:] = aOld
+		for hashCur, hashOld in zip( (_hashSignatures, _hashCache, _hashResources, _hashChildren), ahashState ):
+			hashCur.clear( )
+			hashCur.update( hashOld )
+		os.environ.clear( )
+		os.environ.update( hashEnviron )
+	return afileRet
+
+def _scons_child_check( pE, strDir ):
+	"""
+	Raises a UserError for any command line in a unified child that names a file relative to
+	the child's directory, which would resolve against the parent's directory when it runs.
+	"""
+	import SCons.Errors
+	import SCons.Node.FS
+
+	strTop = pE.Dir( "#" ).get_abspath( )
+	apNodes, setstrPaths = [], set()
+	apDirs = [pE.Dir( strDir )]
+	while apDirs:
+		for strName, pNode in apDirs.pop( ).entries.items( ):
+			if strName in (".", ".."):
+				continue
+			if isinstance( pNode, SCons.Node.FS.Dir ):
+				apDirs.append( pNode )
+				continue
+			apNodes.append( pNode )
+			setstrPaths.add( os.path.relpath( pNode.get_abspath( ), strDir ) )
+	for pNode in apNodes:
+		if not pNode.has_builder( ):
+			continue
+		for pAction in pNode.get_executor( ).get_action_list( ):
+			pCmd = getattr( pAction, "cmd_list", None )
+			astrCmd = pCmd.split( ) if isinstance( pCmd, str ) else \
+				[str(p) for p in ( pCmd or [] ) if isinstance( p, str )]
+			for strToken in astrCmd:
+				strToken = strToken.lstrip( "<>|&;(" ).strip( "'\"" )
+				if ( not strToken ) or ( "$" in strToken ) or strToken.startswith( "-" ) or os.path.isabs( strToken ):
+					continue
+				if ( ( strToken in setstrPaths ) or os.path.exists( d( strDir, strToken ) ) ) and \
+					not os.path.exists( d( strTop, strToken ) ):
+					raise SCons.Errors.UserError( "%s: \"%s\" names %s relative to the child directory; use "
+						"$TARGET, $SOURCE, or an absolute path, or build the child recursively" %
+						(pNode, pCmd, strToken) )
+
+def scons_child( pE, fileDir, hashArgs = None, fileSConstruct = None, afileDeps = None, fUnified = None ):
+
+	strDir, strSConstruct = (( ( os.path.abspath( f ) if ( type( f ) == str ) else f.get_abspath( ) ) if f else None )
+		for f in (fileDir, fileSConstruct))
+	if fUnified == None:
+		fUnified = _hashChildren["unified"]
+	if fUnified:
+		_scons_child_setup( strDir, strSConstruct, hashArgs )
+		afileDefaults = _scons_child_read( pE, strDir, hashArgs )
+		_scons_child_check( pE, strDir )
+		afileRet = pE.Alias( "dummy:" + os.path.basename( str(fileDir) ), afileDefaults or pE.Dir( strDir ) )
+		if afileDeps:
+			pE.Depends( afileRet, afileDeps )
+		return afileRet
+
+	_hashRecursive["children"] += 1
+	def funcTmp( target, source, env, strDir = strDir, strSConstruct = strSConstruct ):
 #		if os.path.commonprefix( (pE.GetLaunchDir( ), strDir) ) not in [strDir, pE.GetLaunchDir( )]:
 #			return
-		if fileSConstruct:
-			try:
-				os.makedirs( strDir )
-			except os.error:
-				pass
-			subprocess.call( ["ln", "-f", "-s", strSConstruct, d( strDir, "SConstruct" )] )
-		if hashArgs:
-			with open( d( strDir, "SConscript" ), "w" ) as fileOut:
-				fileOut.write( "hashArgs = {\n" )
-				for strKey, strValue in hashArgs.items( ):
-					fileOut.write( "	\"%s\"	: %s,\n" % (strKey, repr( strValue )) )
-				fileOut.write( "}\nExport( \"hashArgs\" )\n" )
-		return subprocess.call( ["scons"] + sys.argv[1:] + ["-C", strDir] )
+		_scons_child_setup( strDir, strSConstruct, hashArgs )
+		iShares, iJobs = _shares( _hashRecursive["children"], env.GetOption( "num_jobs" ) )
+		return subprocess.call( ["scons"] + _jobs( sys.argv[1:], iJobs ) + ["-C", strDir], env = _child_environ( iShares ) )
 	return pE.Command( "dummy:" + os.path.basename( str(fileDir) ), afileDeps, funcTmp )
 
+def _shares( iChildren, iJobs ):
+	"""
+	Returns how many of iChildren recursive builds run at once under scons' -j iJobs, and
+	the job count each of them gets, so that together they run about iJobs jobs.
+
+	>>> _shares( 3, 8 )
+	(3, 2)
+	>>> _shares( 10, 4 )
+	(4, 1)
+	"""
+
+	iShares = max( 1, min( iChildren, iJobs ) )
+	return (iShares, max( 1, iJobs // iShares ))
+
+def _child_environ( iShares ):
+
+	hashRet = dict(os.environ)
+	hashRet.update( _hashResources["budget"].share( iShares ) )
+	return hashRet
+
+def _jobs( astrArgs, iJobs ):
+	"""
+	Replaces any job count in SCons command line arguments with the given one.
+
+	>>> _jobs( ["-j8", "-k", "--jobs", "4", "--jobs=2", "-j", "3", "all"], 1 )
+	['-k', 'all', '-j', '1']
+	"""
+
+	astrRet = []
+	fSkip = False
+	for strArg in astrArgs:
+		if fSkip:
+			fSkip = False
+		elif strArg in ("-j", "--jobs"):
+			fSkip = True
+		elif not ( strArg.startswith( "-j" ) or strArg.startswith( "--jobs=" ) ):
+			astrRet.append( strArg )
+	return ( astrRet + ["-j", str(iJobs)] )
+
+def _scons_child_run( aArgs ):
+
+	strID, strDir, strSConstruct, hashArgs, iShares, iJobs = aArgs
+	astrCmd = ["scons"] + _jobs( sys.argv[1:], iJobs ) + ["-C", strDir]
+	hashEnv = _child_environ( iShares )
+	try:
+		_scons_child_setup( strDir, strSConstruct, hashArgs )
+		if iShares < 2:
+			return (strID, subprocess.call( astrCmd, env = hashEnv ), None)
+		# Concurrent children log to their own directories rather than interleaving on the console
+		strLog = d( strDir, "scons.log" )
+		with open( strLog, "w" ) as fileLog:
+			return (strID, subprocess.call( astrCmd, stdout = fileLog, stderr = subprocess.STDOUT, env = hashEnv ), "see " + strLog)
+	except EnvironmentError as e:
+		return (strID, 1, str(e))
+
+def run_children( aaChildren, iJobs = 1, ostm = sys.stdout ):
+	"""
+	Builds child projects given as (ID, directory, SConstruct, hashArgs) tuples with a pool
+	of up to iJobs concurrent scons processes, one at a time by default.  Each concurrent
+	child receives an equal share of the iJobs jobs and of the resources() budget.
+	Reports progress as children finish and a summary of any failures; returns the number
+	of failed children.
+	"""
+
+	aaChildren = list(aaChildren)
+	if not aaChildren:
+		return 0
+	iShares, iJobs = _shares( len( aaChildren ), iJobs )
+	aaArgs = [list(a) + [iShares, iJobs] for a in aaChildren]
+	astrFailed = []
+	pPool = ThreadPool( iShares )
+	try:
+		for i, (strID, iRet, strLog) in enumerate( pPool.imap_unordered( _scons_child_run, aaArgs ) ):
+			if iRet:
+				astrFailed.append( strID )
+			ostm.write( "[%d/%d] %s %s%s\n" % (i + 1, len( aaArgs ), strID, "FAILED" if iRet else "done",
+				( " (%s)" % strLog ) if ( iRet and strLog ) else "") )
+			ostm.flush( )
+	finally:
+		pPool.close( )
+	if astrFailed:
+		ostm.write( "%d of %d children failed: %s\n" % (len( astrFailed ), len( aaArgs ), " ".join( sorted( astrFailed ) )) )
+	return len( astrFailed )
+
 def scons_children( pE, strDir = ".", afileDeps = None, astrExclude = [] ):
 
 	afileRet = []
@@ -605,13 +1501,18 @@ def scons_children( pE, strDir = ".", afileDeps = None, astrExclude = [] ):
 # http://www.scons.org/wiki/DynamicSourceGenerator
 #------------------------------------------------------------------------------ 
 
+def _sconscript_dir( strDir, iLevel, strID ):
+
+	strDir = strDir if ( type( strDir ) == str ) else strDir.get_abspath( )
+	return d( strDir, c_strDirData if ( iLevel == 1 ) else "", strID )
+
 def sconscript_child( target, source, env, strID, fileSConstruct,
 	hashArgs = None, afileDeps = None, iLevel = 1, strDir = "." ):
 
 	fileTarget = target[0] if ( type( target ) == list ) else target
-	strDir = strDir if ( type( strDir ) == str ) else strDir.get_abspath( )
-	strDir = d( strDir, c_strDirData if ( iLevel == 1 ) else "", strID )
-	return scons_child( env, strDir, hashArgs, fileSConstruct, afileDeps )
+	strDir = _sconscript_dir( strDir, iLevel, strID )
+	# Children scanned during the build cannot join the graph being built, so always recurse
+	return scons_child( env, strDir, hashArgs, fileSConstruct, afileDeps, False )
 
 def sconscript_children( pE, afileSources, funcScanner, iLevel, fileSConstruct, hashArgs = None, funcAction = None ):
 	
@@ -619,13 +1520,20 @@ def sconscript_children( pE, afileSources, funcScanner, iLevel, fileSConstruct,
 		afileSources = [afileSources]
 	def funcTmp( target, source, env, strID, hashArgs = hashArgs, afileDeps = None, iLevel = iLevel, strDir = pE.Dir( "." ) ):
 		return sconscript_child( target, source, env, strID, fileSConstruct, hashArgs, afileDeps, iLevel, strDir )
+	def funcBatch( target, source, env, astrIDs, hashArgs = hashArgs, iLevel = iLevel, strDir = pE.Dir( "." ) ):
+		strSConstruct = fileSConstruct if ( type( fileSConstruct ) in (str, type(None)) ) else fileSConstruct.get_abspath( )
+		# The pool follows scons' own -j, so the default -j 1 builds children one at a time
+		return run_children( ((strID, _sconscript_dir( strDir, iLevel, strID ), strSConstruct, hashArgs)
+			for strID in astrIDs), env.GetOption( "num_jobs" ) )
+	hashActions = {"sconscript_child" : ( funcAction or funcTmp )}
+	# Custom per-child actions are still called one ID at a time
 	if not funcAction:
-		funcAction = funcTmp
+		hashActions["sconscript_children"] = funcBatch
 	
 	strID = ":".join( ["dummy", str(iLevel)] + [os.path.basename( str(f) ) for f in afileSources] )
 	pBuilder = pE.Builder( action = funcScanner )
 	pE.Append( BUILDERS = {strID : pBuilder} )
-	afileSubdirs = getattr( pE, strID )( strID, afileSources, sconscript_child = funcAction )
+	afileSubdirs = getattr( pE, strID )( strID, afileSources, **hashActions )
 	pE.AlwaysBuild( afileSubdirs )
 	return afileSubdirs
 
@@ -635,6 +1543,7 @@ def scanner( fileExclude = None, fileInclude = None ):
 	setstrInclude = set(readcomment( fileInclude ) if fileInclude else [])
 	def funcRet( target, source, env, setstrInclude = setstrInclude, setstrExclude = setstrExclude ):
 		strT, astrSs = ts( target, source )
+		astrIDs = []
 		for strS in astrSs:
 			for astrLine in csv.reader( open( strS ), csv.excel_tab ):
 				if not ( astrLine and astrLine[0] ):
@@ -642,7 +1551,11 @@ def scanner( fileExclude = None, fileInclude = None ):
 				strID = astrLine[0]
 				if ( setstrInclude and ( strID not in setstrInclude ) ) or ( strID in setstrExclude ):
 					continue
-				env["sconscript_child"]( target, source[0], env, strID )
+				astrIDs.append( strID )
+		if "sconscript_children" in env:
+			return env["sconscript_children"]( target, source[0], env, astrIDs )
+		for strID in astrIDs:
+			env["sconscript_child"]( target, source[0], env, strID )
 	return funcRet
 
 #===============================================================================
@@ -41,7 +41,7 @@ class IO:
         self.opened = []
 
     def open( self, fn ):
-        return open( fn )
+        return sfle.zopen( fn )
 
     @property
     def inp_open(self):
@@ -168,7 +168,7 @@ class ooSfle:
         return str(self.lenv.File( sfle.d( self.fileDirTmp, fn ) ))
 
     def f(  self, srs, tgt, func, srs_dep = None, tgt_dep = None, 
-            __kwargs_dict__ = None, fname = None, attempts = 1, **kwargs ):
+            __kwargs_dict__ = None, fname = None, attempts = 1, cores = 1, memory = 0, **kwargs ):
         if srs_dep is None: srs_dep = []
         if tgt_dep is None: tgt_dep = []
         if srs is None:
@@ -197,6 +197,8 @@ class ooSfle:
                     time.sleep(2**(att-attempts))
             return ret      
  
+        # stages wait for their declared cores and memory (bytes or e.g. "8G") to be free
+        _f_ = sfle.reserved( _f_, cores, memory )
         _f_.__name__ = "oo scons: "+(fname if fname else func.func_name)
         return self.lenv.Command( ntgt + ntgt_dep, nsrs + nsrs_dep, _f_ )
 
@@ -245,7 +247,7 @@ class ooSfle:
 
     def ex( self, fr, to, excmd, srs_dep = None, tgt_dep = None, pipe = False, inpipe = False, outpipe = False, 
             args = None, args_after = False, rand_wait = 0, verbose = False, 
-            short_arg_symb = '-', long_arg_symb = '--', __kwargs__ = None, **kwargs ):
+            short_arg_symb = '-', long_arg_symb = '--', __kwargs__ = None, cores = 1, memory = 0, **kwargs ):
         if type(fr) not in [tuple,list]: fr = [fr]
         if type(to) not in [tuple,list]: to = [to]
         inpipe, outpipe = (True, True) if pipe else (inpipe, outpipe)
@@ -313,6 +315,7 @@ class ooSfle:
                        srs_dep = srs_dep, 
                        tgt_dep = tgt_dep, 
                        fname = str(excmd), 
+                       cores = cores, memory = memory,
                        __kwargs_dict__ = kwargs )
 
     def chain( self, excmd, start = None, stop = None, in_pipe = None, short_arg_symb = '-', long_arg_symb = '--', 
@@ -426,7 +429,7 @@ class ooSfle:
 
 
 
-    def raxml_BINCAT( self, srs, tgt, prog = "raxmlHPC", T = 1, srs_dep = None, tgt_dep = None, verbose = False, **kwargs ):
+    def raxml_BINCAT( self, srs, tgt, prog = "raxmlHPC", T = 1, srs_dep = None, tgt_dep = None, verbose = False, memory = 0, **kwargs ):
         
 
         def __raxml__( io ):
@@ -446,10 +449,10 @@ class ooSfle:
             shutil.move( out, io.outf[0] )
 
 
-        self.f( srs, tgt, __raxml__ ) 
+        self.f( srs, tgt, __raxml__, cores = int(T), memory = memory ) 
 
 
-    def bowtie2_4_chocophlan( self, srs, tgt, srs_dep = None, tgt_dep = None, makedb = True, args = None, verbose = False, **kwargs ):
+    def bowtie2_4_chocophlan( self, srs, tgt, srs_dep = None, tgt_dep = None, makedb = True, args = None, verbose = False, memory = 0, **kwargs ):
         #inpf = srs if type(srs) is str else srs[0]
         assert( type(srs) is list and len(srs) == 2 )
         dbfs = [srs[1]+d for d in (['.1.bt2','.2.bt2','.3.bt2','.4.bt2','.rev.1.bt2','.rev.2.bt2'])] 
@@ -461,9 +464,10 @@ class ooSfle:
                 #local = "", a = "",
                 #a = "--very-sensitive-local", 
                 x = srs[1], f = srs[0], outpipe = True, args = args,
+                cores = int(kwargs.get( "p", kwargs.get( "threads", 1 ) )), memory = memory,
                 __kwargs__ = kwargs )
 
-    def blast( self, srs, tgt, prog = "blastn", srs_dep = None, tgt_dep = None, makedb = True, verbose = False, **kwargs ):
+    def blast( self, srs, tgt, prog = "blastn", srs_dep = None, tgt_dep = None, makedb = True, verbose = False, memory = 0, **kwargs ):
         #inpf = srs if type(srs) is str else srs[0]
         assert( type(srs) is list and len(srs) == 2 )
         dbfs = [srs[1]+d for d in (['.nhr','.nin','.nsq'] if prog in ['blastn','tblastx'] else ['.phr','.pin','.psq'])] 
@@ -474,7 +478,8 @@ class ooSfle:
                       outpipe = False, long_arg_symb = '-' )
 
         self.ex( srs, tgt, prog, srs_dep = dbfs, verbose = verbose, 
-                  args = [('-query',srs[0]),('-db',srs[1]),("-out",tgt)], long_arg_symb = '-', __kwargs__ = kwargs )
+                  args = [('-query',srs[0]),('-db',srs[1]),("-out",tgt)], long_arg_symb = '-',
+                  cores = int(kwargs.get( "num_threads", 1 )), memory = memory, __kwargs__ = kwargs )
 
 
     def makeblastpdb( self, srs, tgt = None, srs_dep = None, tgt_dep = None, **kwargs ):
@@ -50,15 +50,52 @@ Examples
 	b
 	c
 
+	$ subsample.py -k 2 < rows.txt
+	b
+	d
+
+	$ subsample.py -k 2 -s 1 < rows.txt
+	a
+	c
+
 .. testsetup::
 
 	from subsample import *
 """
 
 import argparse
+import itertools
+import math
+import os
 import random
+import sfle
+import stat
 import sys
 
+c_iPilot		= 1000
+"""Number of records read from the head, and then landed on across the input, to estimate record lengths for offset sampling."""
+c_iAttempts		= 100
+"""Maximum number of random offsets drawn per requested record before offset sampling gives up."""
+
+def _uniform( ):
+	"""
+	Returns a uniform random value strictly between 0 and 1, safe to take the logarithm of.
+	"""
+
+	dRet = random.random( )
+	while not dRet:
+		dRet = random.random( )
+	return dRet
+
+def _gaps( dFraction ):
+	"""
+	Yields geometrically distributed numbers of lines to skip between Bernoulli(dFraction) successes.
+	"""
+
+	dLog = math.log( 1 - dFraction )
+	while True:
+		yield int( math.log( _uniform( ) ) / dLog )
+
 def subsample( astrIn, ostm, dFraction ):
 	"""
 	Outputs each input row randomly with the specified probability. 
@@ -92,21 +129,222 @@ def subsample( astrIn, ostm, dFraction ):
 	c
 	"""
 	
-	for strLine in astrIn:
-		if random.random( ) <= dFraction:
-			# Note that these have not been stripped and thus still include their trailing newline
-			ostm.write( strLine )
+	if dFraction >= 1:
+		ostm.writelines( astrIn )
+		return
+	if dFraction <= 0:
+		return
+	# Rather than drawing for every line, jump directly to the next selected line
+	iterIn = iter( astrIn )
+	for iGap in _gaps( dFraction ):
+		strLine = next( itertools.islice( iterIn, iGap, None ), None )
+		if strLine == None:
+			break
+		# Note that these have not been stripped and thus still include their trailing newline
+		ostm.write( strLine )
+
+def reservoir( astrIn, ostm, iCount ):
+	"""
+	Outputs exactly iCount input rows (or all rows, if fewer) chosen uniformly at random
+	in a single pass, preserving their input order.  Uses reservoir sampling with
+	geometric skips (Li's Algorithm L), so the number of random draws grows with the
+	sample size and only logarithmically with the input length.
+	
+	:param	astrIn:		Input rows.
+	:type	astrIn:		collection of strings
+	:param	ostm:		Output stream to which selected rows are written.
+	:type	ostm:		output stream
+	:param	iCount:		Number of rows to output.
+	:type	iCount:		int
+
+	>>> astrIn = [( "%s\\n" % s ) for s in "abcd"]
+	>>> reservoir( astrIn, sys.stdout, 5 )
+	a
+	b
+	c
+	d
+
+	>>> reservoir( astrIn, sys.stdout, 2 ) #doctest: +SKIP
+	b
+	d
+	"""
+
+	if iCount <= 0:
+		return
+	iterIn = enumerate( astrIn )
+	apReservoir = list( itertools.islice( iterIn, iCount ) )
+	if len( apReservoir ) == iCount:
+		dW = math.exp( math.log( _uniform( ) ) / iCount )
+		while True:
+			pItem = next( itertools.islice( iterIn, int( math.log( _uniform( ) ) / math.log( 1 - dW ) ), None ), None )
+			if pItem == None:
+				break
+			apReservoir[random.randrange( iCount )] = pItem
+			dW *= math.exp( math.log( _uniform( ) ) / iCount )
+	ostm.writelines( strLine for i, strLine in sorted( apReservoir ) )
+
+def _record( pIn, iOffset, fFASTA ):
+	"""
+	Returns the (begin, end) byte range of the line or FASTA record containing an offset.
+
+	>>> _record( "ab\\ncd\\nef", 4, False )
+	(3, 6)
+	>>> _record( ">a\\nAC\\nGT\\n>b\\nTT\\n", 5, True )
+	(0, 9)
+	>>> _record( ">a\\nAC\\nGT\\n>b\\nTT\\n", 9, True )
+	(9, 15)
+	"""
+
+	strSep = "\n>" if fFASTA else "\n"
+	iBegin = pIn.rfind( strSep, 0, iOffset + len( strSep ) - 1 ) + 1
+	iEnd = pIn.find( strSep, iOffset ) + 1 or len( pIn )
+	return (iBegin, iEnd)
+
+def _records( pIn, fFASTA ):
+	"""
+	Yields the (begin, end) byte range of every line or FASTA record in turn.
+
+	>>> list( _records( ">a\\nAC\\n>b\\nTT\\n", True ) )
+	[(0, 6), (6, 12)]
+	"""
+
+	iBegin = 0
+	while iBegin < len( pIn ):
+		iBegin, iEnd = _record( pIn, iBegin, fFASTA )
+		yield (iBegin, iEnd)
+		iBegin = iEnd
+
+def subsample_offsets( pIn, ostm, dFraction, iCount, fFASTA ):
+	"""
+	Outputs randomly chosen lines or FASTA records of a string or memory-mapped file by
+	seeking to random byte offsets, so that cost scales with sample size rather than
+	input size.  Records are output once each, in input order.
+	
+	The target number of records is iCount if given, or otherwise dFraction times the
+	record count.  This is exact if the first ``c_iPilot`` records are the whole input,
+	and is otherwise estimated as the input size times the mean inverse length of
+	``c_iPilot`` records landed on at offsets spread evenly across the input, since a
+	landing picks each record with probability proportional to its length.  For the
+	same reason, each landing is accepted with probability *m* / *length*, where *m* is
+	the shortest length among the pilot records.  This removes the
+	length bias exactly for records at least *m* bytes long; shorter records are
+	accepted whenever landed on and thus remain proportionally undersampled.  At
+	most ``c_iAttempts`` offsets are drawn per requested record.  If iCount was
+	given and fewer records have been accepted by then, e.g. because a few short
+	records make acceptance rare, the rest are chosen uniformly from the remaining
+	records in one sequential pass, so exactly iCount records are output.
+	
+	:param	pIn:		Raw lines or FASTA records from which data are read.
+	:type	pIn:		string or mmap
+	:param	ostm:		Output stream to which selected records are written.
+	:type	ostm:		output stream
+	:param	dFraction:	Approximate fraction of records to output if iCount is None.
+	:type	dFraction:	float
+	:param	iCount:		Number of records to output (or all records, if fewer).
+	:type	iCount:		int
+	:param	fFASTA:		If true, records are FASTA entries rather than single lines.
+	:type	fFASTA:		bool
+
+	>>> subsample_offsets( "a\\nb\\nc\\nd\\n", sys.stdout, 1, None, False )
+	a
+	b
+	c
+	d
+
+	>>> random.seed( 1 )
+	>>> strIn = "".join( "%d\\n" % i for i in range( 1, 100001 ) )
+	>>> import cStringIO
+	>>> ostm = cStringIO.StringIO( )
+	>>> subsample_offsets( strIn, ostm, 0.01, None, False )
+	>>> 900 < ostm.getvalue( ).count( "\\n" ) < 1100
+	True
+
+	>>> subsample_offsets( ">a\\nAC\\n>b\\nGT\\n>c\\nTT\\n", sys.stdout, None, 1, True ) #doctest: +SKIP
+	>b
+	GT
+	"""
+
+	iSize = len( pIn )
+	aiLengths = []
+	iBegin = 0
+	while ( iBegin < iSize ) and ( len( aiLengths ) < c_iPilot ):
+		iBegin, iEnd = _record( pIn, iBegin, fFASTA )
+		aiLengths.append( iEnd - iBegin )
+		iBegin = iEnd
+	if not aiLengths:
+		return
+	# The pilot covered the whole input, so the record count is exact
+	fComplete = iBegin >= iSize
+	if fComplete:
+		iRecords = len( aiLengths )
+	else:
+		dInverses = 0
+		for i in range( c_iPilot ):
+			iBegin, iEnd = _record( pIn, int( ( i + random.random( ) ) * iSize / c_iPilot ), fFASTA )
+			aiLengths.append( iEnd - iBegin )
+			dInverses += 1.0 / ( iEnd - iBegin )
+		iRecords = int( round( iSize * dInverses / c_iPilot ) )
+	fExact = iCount != None
+	if not fExact:
+		iCount = int( round( dFraction * iRecords ) )
+	# Only a complete pilot bounds an exact count; the sequential pass handles any shortfall
+	if fComplete or not fExact:
+		iCount = min( iCount, iRecords )
+	iMin = min( aiLengths )
+	setiChosen = set()
+	iAttempts = c_iAttempts * iCount
+	while ( len( setiChosen ) < iCount ) and ( iAttempts > 0 ):
+		iAttempts -= 1
+		iBegin, iEnd = _record( pIn, random.randrange( iSize ), fFASTA )
+		if random.random( ) * ( iEnd - iBegin ) < iMin:
+			setiChosen.add( iBegin )
+	iRest = ( iCount - len( setiChosen ) ) if fExact else 0
+	if iRest > 0:
+		aiRest = []
+		for i, (iBegin, iEnd) in enumerate( p for p in _records( pIn, fFASTA ) if ( p[0] not in setiChosen ) ):
+			if i < iRest:
+				aiRest.append( iBegin )
+			else:
+				iReplace = random.randint( 0, i )
+				if iReplace < iRest:
+					aiRest[iReplace] = iBegin
+		setiChosen.update( aiRest )
+	for iBegin in sorted( setiChosen ):
+		iBegin, iEnd = _record( pIn, iBegin, fFASTA )
+		ostm.write( pIn[iBegin:iEnd] )
 
 argp = argparse.ArgumentParser( prog = "subsample.py",
 	description = "Outputs a random subsample of input lines." )
-argp.add_argument( "-f",		dest = "dFraction",		metavar = "fraction",
-	type = float,	required = True,
+argpMode = argp.add_mutually_exclusive_group( required = True )
+argpMode.add_argument( "-f",	dest = "dFraction",		metavar = "fraction",
+	type = float,
 	help = "Probability with which each input line is included in output" )
+argpMode.add_argument( "-k",	dest = "iCount",		metavar = "count",
+	type = int,
+	help = "Exact number of input lines to include in output" )
+argp.add_argument( "-s",		dest = "iSeed",			metavar = "seed",
+	type = int,
+	help = "Random seed for reproducible output" )
+argp.add_argument( "-o",		dest = "fOffsets",		action = "store_true",
+	help = "Sample random byte offsets of a regular input file rather than reading every line" )
+argp.add_argument( "-a",		dest = "fFASTA",		action = "store_true",
+	help = "With -o, sample multi-line FASTA records rather than lines" )
 __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	subsample( sys.stdin, sys.stdout, args.dFraction )
+	if args.iSeed != None:
+		random.seed( args.iSeed )
+	if args.fOffsets:
+		mmapIn = sfle.mapfile( sys.stdin )
+		if mmapIn:
+			subsample_offsets( mmapIn, sys.stdout, args.dFraction, args.iCount, args.fFASTA )
+		elif not stat.S_ISREG( os.fstat( sys.stdin.fileno( ) ).st_mode ):
+			argp.error( "-o requires a regular input file" )
+	elif args.iCount != None:
+		reservoir( sys.stdin, sys.stdout, args.iCount )
+	else:
+		subsample( sys.stdin, sys.stdout, args.dFraction )
 
 if __name__ == "__main__":
 	_main( )
@@ -45,7 +45,15 @@ Examples
 
 import argparse
 import csv
+import itertools
+import sfle
 import sys
+import tempfile
+
+c_iRowOverhead	= 64
+"""Approximate bytes of Python object overhead per buffered row and cell."""
+c_iPasteFanIn	= 64
+"""Maximum number of tile files read (and thus held open) at once."""
 
 def transpose( aastrIn, ostm ):
 	"""
@@ -72,15 +80,97 @@ def transpose( aastrIn, ostm ):
 	for iRow in range( len( aastrLines[0] ) ):
 		csvw.writerow( [aastrLines[iCol][iRow] for iCol in range( len( aastrLines ) )] )
 
+def _tile( aastrBand, iWidth ):
+	"""
+	Writes the transpose of a band of rows, padded or truncated to iWidth columns, to a rewound temporary file.
+	"""
+
+	fileRet = tempfile.TemporaryFile( )
+	csvw = csv.writer( fileRet, csv.excel_tab )
+	for iRow in range( iWidth ):
+		csvw.writerow( [( astrLine[iRow] if ( iRow < len( astrLine ) ) else "" ) for astrLine in aastrBand] )
+	fileRet.seek( 0 )
+	return fileRet
+
+def _paste( afileTiles ):
+	"""
+	Yields rows formed by concatenating the corresponding rows of each tile file, read in lockstep.
+	"""
+
+	for aastrRows in itertools.izip( *[csv.reader( f, csv.excel_tab ) for f in afileTiles] ):
+		yield [s for a in aastrRows for s in a]
+
+def _repaste( afileTiles ):
+	"""
+	Pastes consecutive tile files into a single wider, rewound tile file, closing the originals.
+	"""
+
+	fileRet = tempfile.TemporaryFile( )
+	csv.writer( fileRet, csv.excel_tab ).writerows( _paste( afileTiles ) )
+	fileRet.seek( 0 )
+	for fileCur in afileTiles:
+		fileCur.close( )
+	return fileRet
+
+def transpose_blocked( aastrIn, ostm, iMemory ):
+	"""
+	Outputs the matrix transpose of the input tab-delimited rows using bounded memory.
+	
+	Input rows are buffered in bands of roughly iMemory bytes, and each band's
+	transpose is written to a temporary tile file.  Output rows are then assembled
+	by reading every tile sequentially in lockstep, pasting at most ``c_iPasteFanIn``
+	tiles at a time (so very tall inputs cost one extra sequential pass per factor of
+	``c_iPasteFanIn`` tiles).  As in :py:func:`transpose`, output has one row per
+	column of the first input row; shorter rows are padded with empty values.
+	
+	:param	aastrIn:	Split lines from which data are read.
+	:type	aastrIn:	collection of string collections
+	:param	ostm:		Output stream to which transposed rows are written.
+	:type	ostm:		output stream
+	:param	iMemory:	Approximate number of bytes of input rows to buffer at once.
+	:type	iMemory:	int
+
+	>>> aastrIn = [list(s) for s in ("ab", "cd", "e")]
+	>>> transpose_blocked( aastrIn, sys.stdout, 1 ) #doctest: +NORMALIZE_WHITESPACE
+	a	c	e
+	b	d	
+	"""
+
+	iWidth = None
+	afileTiles, aastrBand, iSize = [], [], 0
+	for astrLine in aastrIn:
+		if iWidth == None:
+			iWidth = len( astrLine )
+		aastrBand.append( astrLine )
+		iSize += c_iRowOverhead * ( 1 + len( astrLine ) ) + sum( len( s ) for s in astrLine )
+		if iSize >= iMemory:
+			afileTiles.append( _tile( aastrBand, iWidth ) )
+			aastrBand, iSize = [], 0
+	if aastrBand:
+		afileTiles.append( _tile( aastrBand, iWidth ) )
+	# Collapse consecutive tiles in batches until the remainder can be pasted in a single pass
+	while len( afileTiles ) > c_iPasteFanIn:
+		afileTiles = [_repaste( afileTiles[i:( i + c_iPasteFanIn )] )
+			for i in range( 0, len( afileTiles ), c_iPasteFanIn )]
+	csv.writer( ostm, csv.excel_tab ).writerows( _paste( afileTiles ) )
+	for fileCur in afileTiles:
+		fileCur.close( )
+
 argp = argparse.ArgumentParser( prog = "transpose.py",
 	description = """Transposes a tab-delimited text matrix.
 
 The transposition process is robust to missing elements and rows of differing lengths.""" )
+argp.add_argument( "-m", "--max-memory",	dest = "iMemory",	metavar = "size",
+	type = sfle.bytesize,
+	help = "Transpose out of core in tiles within this memory budget (e.g. 512M)" )
 __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	transpose( csv.reader( sys.stdin, csv.excel_tab ), sys.stdout )
+	if args.iMemory:
+		transpose_blocked( csv.reader( sys.stdin, csv.excel_tab ), sys.stdout, args.iMemory )
+	else:
+		transpose( csv.reader( sys.stdin, csv.excel_tab ), sys.stdout )
 
 if __name__ == "__main__":
 	_main( )
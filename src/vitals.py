@@ -53,12 +53,377 @@ Examples
 """
 
 import argparse
+import base64
 import csv
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+import sfle
+import struct
 import sys
 
+c_iRange	= 1 << 26
+"""Maximum number of bytes summarized by each parallel task."""
+c_iQuantileK	= 200
+"""Capacity of the largest KLL compactor; rank error is roughly 1.7 / c_iQuantileK."""
+c_iDistinctP	= 12
+"""log2 of the number of HyperLogLog registers; relative error is roughly 1.04 / 2**(c_iDistinctP / 2)."""
+
+_hashWorker = {}
+"""Read-only input inherited by forked worker processes."""
+
+class CMoments:
+	"""
+	Streaming count, sum, mean, variance, minimum, and maximum of a series of numbers.
+	
+	Mean and variance are accumulated with Welford's update, which avoids the
+	cancellation of the textbook sum-of-squares formula, and two instances summarizing
+	disjoint parts of a series combine exactly with :py:meth:`merge` (Chan et al.'s
+	pairwise update), so partial results from chunks or workers can be reduced.
+	
+	>>> pOne, pTwo = CMoments( ), CMoments( )
+	>>> for d in (1.0, 2.0): pOne.add( d )
+	>>> for d in (3.0, 4.0, 5.0): pTwo.add( d )
+	>>> pOne.merge( pTwo ).get( )
+	(5, 15.0, 3.0, 2.5, 1.0, 5.0)
+	
+	>>> pBig = CMoments( )
+	>>> for d in (1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16): pBig.add( d )
+	>>> pBig.variance( )
+	30.0
+	"""
+
+	def __init__( self ):
+
+		self.m_iCount = 0
+		self.m_dSum = 0.0
+		self.m_dMean = 0.0
+		self.m_dM2 = 0.0
+		"""Sum of squared deviations from the current mean."""
+		self.m_dMin = self.m_dMax = None
+
+	def add( self, d ):
+
+		self.m_iCount += 1
+		self.m_dSum += d
+		dDelta = d - self.m_dMean
+		self.m_dMean += dDelta / self.m_iCount
+		self.m_dM2 += dDelta * ( d - self.m_dMean )
+		if ( self.m_dMin == None ) or ( d < self.m_dMin ):
+			self.m_dMin = d
+		if ( self.m_dMax == None ) or ( d > self.m_dMax ):
+			self.m_dMax = d
+
+	def merge( self, pOther ):
+
+		if not pOther.m_iCount:
+			return self
+		if not self.m_iCount:
+			self.__dict__.update( pOther.__dict__ )
+			return self
+		iCount = self.m_iCount + pOther.m_iCount
+		dDelta = pOther.m_dMean - self.m_dMean
+		self.m_dM2 += pOther.m_dM2 + ( dDelta * dDelta * self.m_iCount * pOther.m_iCount / iCount )
+		self.m_dMean += dDelta * pOther.m_iCount / iCount
+		self.m_iCount = iCount
+		self.m_dSum += pOther.m_dSum
+		self.m_dMin, self.m_dMax = min( self.m_dMin, pOther.m_dMin ), max( self.m_dMax, pOther.m_dMax )
+		return self
+
+	def variance( self ):
+		"""Sample variance (unbiased estimator), or zero for fewer than two values."""
+
+		return ( ( self.m_dM2 / ( self.m_iCount - 1 ) ) if ( self.m_iCount > 1 ) else 0.0 )
+
+	def sd( self ):
+
+		return ( self.variance( ) ** 0.5 )
+
+	def mean( self ):
+		"""Mean as sum over count, exactly as reported before streaming; m_dMean serves only the variance."""
+
+		return ( ( self.m_dSum / self.m_iCount ) if self.m_iCount else self.m_dSum )
+
+	def get( self ):
+		"""Returns (count, sum, mean, variance, minimum, maximum)."""
+
+		return (self.m_iCount, self.m_dSum, self.mean( ), self.variance( ), self.m_dMin, self.m_dMax)
+
+def columns( aastrLines ):
+	"""
+	Returns streaming statistics for every column of the given lines, computed in one pass.
+	
+	:param	aastrLines:	Split lines from which numbers are read.
+	:type	aastrLines:	collection of string collections
+	:returns:			list of :py:class:`CMoments` -- one per column; non-numerical values are ignored
+	
+	>>> aastrLines = [s.split( " " ) for s in ("1 A", "", "3 B", "text", "8 Q 2")]
+	>>> [p.get( ) for p in columns( aastrLines )]
+	[(3, 12.0, 4.0, 13.0, 1.0, 8.0), (0, 0.0, 0.0, 0.0, None, None), (1, 2.0, 2.0, 0.0, 2.0, 2.0)]
+	"""
+
+	apRet = []
+	for astrLine in aastrLines:
+		if len( astrLine ) > len( apRet ):
+			apRet.extend( CMoments( ) for i in range( len( astrLine ) - len( apRet ) ) )
+		for i in range( len( astrLine ) ):
+			try:
+				d = float(astrLine[i])
+			except ValueError:
+				continue
+			apRet[i].add( d )
+	return apRet
+
+class CQuantiles:
+	"""
+	Bounded-memory streaming quantile sketch (Karnin, Lang, and Liberty's KLL).
+	
+	Values enter a hierarchy of compactors; whenever one fills, it is sorted and
+	every other value (from a random offset) is promoted to the next level with
+	doubled weight.  Memory stays O(k) regardless of input size, and sketches of
+	disjoint inputs merge by concatenating compactors level by level.
+	
+	>>> pOne, pTwo = CQuantiles( ), CQuantiles( )
+	>>> for i in range( 1000 ): pOne.add( float(i) )
+	>>> for i in range( 1000, 2000 ): pTwo.add( float(i) )
+	>>> pOne.merge( pTwo ).count( )
+	2000
+	>>> abs( pOne.quantile( 0.5 ) - 1000 ) < 50
+	True
+	>>> pThree = CQuantiles.load( json.loads( json.dumps( pOne.dump( ) ) ) )
+	>>> pThree.quantile( 0.5 ) == pOne.quantile( 0.5 )
+	True
+	"""
+
+	def __init__( self, iK = c_iQuantileK ):
+
+		self.m_iK = iK
+		self.m_iCount = 0
+		self.m_aadCompactors = [[]]
+		"""Values held at each level; a value at level h stands for 2**h inputs."""
+
+	def _capacity( self, iLevel ):
+
+		return ( int( math.ceil( self.m_iK * ( ( 2.0 / 3 ) ** ( len( self.m_aadCompactors ) - iLevel - 1 ) ) ) ) + 1 )
+
+	def _compress( self ):
+
+		for iLevel in range( len( self.m_aadCompactors ) ):
+			adCur = self.m_aadCompactors[iLevel]
+			if len( adCur ) >= self._capacity( iLevel ):
+				if ( iLevel + 1 ) >= len( self.m_aadCompactors ):
+					self.m_aadCompactors.append( [] )
+				adCur.sort( )
+				# Keep an odd leftover at this level, promote every other sorted value
+				iKeep = len( adCur ) % 2
+				self.m_aadCompactors[iLevel + 1].extend( adCur[( iKeep + random.randint( 0, 1 ) )::2] )
+				del adCur[iKeep:]
+
+	def _size( self ):
+
+		return sum( len( a ) for a in self.m_aadCompactors )
+
+	def _full( self ):
+
+		return ( self._size( ) >= sum( self._capacity( i ) for i in range( len( self.m_aadCompactors ) ) ) )
+
+	def add( self, d ):
+
+		self.m_iCount += 1
+		self.m_aadCompactors[0].append( d )
+		if len( self.m_aadCompactors[0] ) >= self._capacity( 0 ) and self._full( ):
+			self._compress( )
+
+	def merge( self, pOther ):
+
+		while len( self.m_aadCompactors ) < len( pOther.m_aadCompactors ):
+			self.m_aadCompactors.append( [] )
+		for iLevel in range( len( pOther.m_aadCompactors ) ):
+			self.m_aadCompactors[iLevel].extend( pOther.m_aadCompactors[iLevel] )
+		self.m_iCount += pOther.m_iCount
+		while self._full( ):
+			self._compress( )
+		return self
+
+	def count( self ):
+
+		return self.m_iCount
+
+	def quantile( self, dQuantile ):
+		"""Approximate value below which the given fraction of inputs lies, or None if empty."""
+
+		apWeighted = sorted( (d, 1 << iLevel) for iLevel in range( len( self.m_aadCompactors ) )
+			for d in self.m_aadCompactors[iLevel] )
+		if not apWeighted:
+			return None
+		dTarget, iSum = dQuantile * sum( iWeight for d, iWeight in apWeighted ), 0
+		for d, iWeight in apWeighted:
+			iSum += iWeight
+			if iSum >= dTarget:
+				return d
+		return apWeighted[-1][0]
+
+	def dump( self ):
+
+		return {"k" : self.m_iK, "count" : self.m_iCount, "compactors" : self.m_aadCompactors}
+
+	@staticmethod
+	def load( hashState ):
+
+		pRet = CQuantiles( hashState["k"] )
+		pRet.m_iCount = hashState["count"]
+		pRet.m_aadCompactors = hashState["compactors"]
+		return pRet
+
+class CDistinct:
+	"""
+	Bounded-memory streaming distinct value counter (Flajolet et al.'s HyperLogLog).
+	
+	Each value's 64-bit hash selects a register, which keeps the longest run of
+	leading zeros seen among the remaining bits.  Sketches of any inputs merge by
+	taking register-wise maxima, so counts over unions of files need no rescanning.
+	
+	>>> pOne, pTwo = CDistinct( ), CDistinct( )
+	>>> for i in range( 5000 ): pOne.add( str(i) )
+	>>> for i in range( 2500, 7500 ): pTwo.add( str(i) )
+	>>> abs( pOne.merge( pTwo ).count( ) - 7500 ) < 500
+	True
+	>>> CDistinct.load( json.loads( json.dumps( pOne.dump( ) ) ) ).count( ) == pOne.count( )
+	True
+	"""
+
+	def __init__( self, iP = c_iDistinctP ):
+
+		self.m_iP = iP
+		self.m_abRegisters = bytearray( 1 << iP )
+
+	def add( self, strValue ):
+
+		iHash = struct.unpack( "<Q", hashlib.md5( strValue ).digest( )[:8] )[0]
+		iRegister = iHash >> ( 64 - self.m_iP )
+		iRest = ( iHash << self.m_iP ) & 0xFFFFFFFFFFFFFFFF
+		iRank = ( 64 - iRest.bit_length( ) + 1 ) if iRest else ( 64 - self.m_iP + 1 )
+		if iRank > self.m_abRegisters[iRegister]:
+			self.m_abRegisters[iRegister] = iRank
+
+	def merge( self, pOther ):
+
+		for i in range( len( self.m_abRegisters ) ):
+			if pOther.m_abRegisters[i] > self.m_abRegisters[i]:
+				self.m_abRegisters[i] = pOther.m_abRegisters[i]
+		return self
+
+	def count( self ):
+
+		iM = len( self.m_abRegisters )
+		dRet = 0.7213 / ( 1 + 1.079 / iM ) * iM * iM / sum( 2.0 ** -i for i in self.m_abRegisters )
+		iZeros = self.m_abRegisters.count( "\0" )
+		# Small cardinalities are estimated more accurately by linear counting of empty registers
+		if ( dRet <= ( 2.5 * iM ) ) and iZeros:
+			dRet = iM * math.log( float(iM) / iZeros )
+		return int( round( dRet ) )
+
+	def dump( self ):
+
+		return {"p" : self.m_iP, "registers" : base64.b64encode( str(self.m_abRegisters) )}
+
+	@staticmethod
+	def load( hashState ):
+
+		pRet = CDistinct( hashState["p"] )
+		pRet.m_abRegisters = bytearray( base64.b64decode( hashState["registers"] ) )
+		return pRet
+
+class CSketch:
+	"""
+	Per-column pair of a numeric :py:class:`CQuantiles` and an all-value :py:class:`CDistinct`.
+	"""
+
+	def __init__( self ):
+
+		self.m_pQuantiles = CQuantiles( )
+		self.m_pDistinct = CDistinct( )
+
+	def add( self, strValue ):
+
+		self.m_pDistinct.add( strValue )
+		try:
+			self.m_pQuantiles.add( float(strValue) )
+		except ValueError:
+			pass
+
+	def merge( self, pOther ):
+
+		self.m_pQuantiles.merge( pOther.m_pQuantiles )
+		self.m_pDistinct.merge( pOther.m_pDistinct )
+		return self
+
+	def dump( self ):
+
+		return {"quantiles" : self.m_pQuantiles.dump( ), "distinct" : self.m_pDistinct.dump( )}
+
+	@staticmethod
+	def load( hashState ):
+
+		pRet = CSketch( )
+		pRet.m_pQuantiles = CQuantiles.load( hashState["quantiles"] )
+		pRet.m_pDistinct = CDistinct.load( hashState["distinct"] )
+		return pRet
+
+def sketches( aastrLines ):
+	"""
+	Returns quantile and distinct count sketches for every column of the given lines, computed in one pass.
+	
+	:param	aastrLines:	Split lines from which values are read.
+	:type	aastrLines:	collection of string collections
+	:returns:			list of :py:class:`CSketch` -- one per column; empty values are ignored
+	
+	>>> apSketches = sketches( [s.split( " " ) for s in ("1 A", "", "3 B", "text", "8 A")] )
+	>>> [(p.m_pQuantiles.quantile( 0.5 ), p.m_pDistinct.count( )) for p in apSketches]
+	[(3.0, 4), (None, 2)]
+	"""
+
+	apRet = []
+	for astrLine in aastrLines:
+		if len( astrLine ) > len( apRet ):
+			apRet.extend( CSketch( ) for i in range( len( astrLine ) - len( apRet ) ) )
+		for i in range( len( astrLine ) ):
+			if astrLine[i]:
+				apRet[i].add( astrLine[i] )
+	return apRet
+
+def merge_sketches( apOne, apTwo ):
+	"""
+	Merges a second list of per-column sketches (or moments) into the first, which is returned.
+	"""
+
+	for i in range( len( apTwo ) ):
+		if i < len( apOne ):
+			apOne[i].merge( apTwo[i] )
+		else:
+			apOne.append( apTwo[i] )
+	return apOne
+
+def save_sketches( apSketches, ostm ):
+	"""
+	Writes per-column sketches to an output stream as JSON.
+	"""
+
+	json.dump( [p.dump( ) for p in apSketches], ostm )
+
+def load_sketches( istm ):
+	"""
+	Reads per-column sketches written by :py:func:`save_sketches`.
+	"""
+
+	return [CSketch.load( h ) for h in json.load( istm )]
+
 def vitals( aastrLines ):
 	"""
 	Returns the sum, mean, and standard deviation of the numerical first elements of the given lines.
+	The standard deviation of a single number is zero, and input with no numbers yields integer zeros.
 	
 	:param	aastrLines:	Split lines from which numbers are read.
 	:type	aastrLines:	collection of string collections
@@ -71,14 +436,34 @@ def vitals( aastrLines ):
 	>>> aastrLines = [s.split( " " ) for s in ("1 A", "", "3 B", "text", "8 Q")]
 	>>> [round( d, 4 ) for d in vitals( aastrLines )]
 	[12.0, 4.0, 3.6056]
+
+	>>> vitals( [["5"]] )
+	(5.0, 5.0, 0.0)
+	>>> vitals( [["text"], []] )
+	(0, 0, 0)
+	"""
+
+	return _vitals( first_column( aastrLines )[0] )
+
+def _vitals( pMoments ):
 	"""
+	Returns the sum, mean, and standard deviation reported by :py:func:`vitals` for the given statistics.
+	"""
+
+	if not pMoments.m_iCount:
+		return (0, 0, 0)
+	return (pMoments.m_dSum, pMoments.mean( ), pMoments.sd( ))
 
-	dS = dSS = iCount = 0
+def first_column( aastrLines ):
 	"""
-	dS		= Sum
-	dSS		= Sum of squares
-	iCount	= Count of processed (not discarded) lines
+	Returns streaming statistics for only the first column of the given lines, in the
+	list form of :py:func:`columns` so that it can summarize ranges in parallel.
+
+	>>> [p.get( ) for p in first_column( [s.split( " " ) for s in ("1 A", "", "3 B", "text", "8 Q")] )]
+	[(3, 12.0, 4.0, 13.0, 1.0, 8.0)]
 	"""
+
+	pMoments = CMoments( )
 	for astrLine in aastrLines:
 		if not astrLine:
 			continue
@@ -86,27 +471,107 @@ def vitals( aastrLines ):
 			d = float(astrLine[0])
 		except ValueError:
 			continue
-		iCount += 1
-		dS += d
-		dSS += d * d
-	dAve = dS
-	"""dAve	= Average computed from dS and iCount"""
-	if iCount > 1:
-		dAve /= iCount
-		dSS = ( iCount * ( ( dSS / iCount ) - ( dAve * dAve ) ) / ( iCount - 1 ) )**0.5
-		"""dSS = Sample standard deviation (unbiased estimator; see http://en.wikipedia.org/wiki/Computational_formula_for_the_variance)"""
-	return (dS, dAve, dSS)
+		pMoments.add( d )
+	return [pMoments]
+
+def _columns_range( aiRange ):
+	"""
+	Summarizes one byte range of the shared input in a worker process.
+	"""
+
+	return _hashWorker["funcColumns"]( csv.reader( sfle.maplines( _hashWorker["pIn"], aiRange[0], aiRange[1] ),
+		csv.excel_tab ) )
+
+def columns_parallel( pIn, iJobs, funcColumns = columns ):
+	"""
+	Returns the same per-column statistics as :py:func:`columns` (or another per-column
+	summary such as :py:func:`sketches`) for raw tab-delimited text, summarizing
+	newline-aligned byte ranges in iJobs worker processes and merging their partial
+	results in input order.  Input containing any quote character is summarized
+	serially, since quoted fields may span range boundaries.
+	
+	:param	pIn:			Raw tab-delimited text from which numbers are read.
+	:type	pIn:			string or mmap
+	:param	iJobs:			Number of worker processes.
+	:type	iJobs:			int
+	:param	funcColumns:	Function summarizing split lines as a list of mergeable per-column objects.
+	:type	funcColumns:	function
+	:returns:				list of :py:class:`CMoments` (or funcColumns' objects) -- one per column
+	
+	>>> [p.get( ) for p in columns_parallel( "1\\tA\\n\\n3\\tB\\ntext\\n8\\tQ\\n", 2 )]
+	[(3, 12.0, 4.0, 13.0, 1.0, 8.0), (0, 0.0, 0.0, 0.0, None, None)]
+	"""
+
+	if ( iJobs < 2 ) or ( pIn.find( "\"" ) >= 0 ):
+		return funcColumns( csv.reader( sfle.maplines( pIn, 0, len( pIn ) ), csv.excel_tab ) )
+	_hashWorker.update( {"pIn" : pIn, "funcColumns" : funcColumns} )
+	pPool = multiprocessing.Pool( iJobs )
+	try:
+		apRet = []
+		for apCur in pPool.imap( _columns_range, sfle.mapranges( pIn, max( 4 * iJobs, len( pIn ) / c_iRange ) ) ):
+			merge_sketches( apRet, apCur )
+	finally:
+		pPool.terminate( )
+		_hashWorker.clear( )
+	return apRet
 
 argp = argparse.ArgumentParser( prog = "vitals.py",
 	description = """Reads a list of numbers and outputs their sum, mean, and standard deviation.
 
 This list can optionally be the first column of a tab-delimited text file and/or contain blank lines or non-numerical values, which are ignored.""" )
+argp.add_argument( "-a",		dest = "fAll",		action = "store_true",
+	help = "Output count, sum, mean, variance, SD, minimum, and maximum for every column" )
+argp.add_argument( "-j",		dest = "iJobs",		metavar = "jobs",
+	type = int,		default = 1,
+	help = "Number of processes summarizing a regular (seekable) input file" )
+argp.add_argument( "-q",		dest = "strQuantiles",	metavar = "quantiles",
+	help = "Output these comma-separated approximate quantiles and a distinct count for every column" )
+argp.add_argument( "-o",		dest = "ostmSketches",	metavar = "sketches.json",
+	type = argparse.FileType( "w" ),
+	help = "Save every column's quantile and distinct count sketches to this file" )
+argp.add_argument( "-i",		dest = "aistmSketches",	metavar = "sketches.json",
+	type = argparse.FileType( "r" ),	action = "append",
+	help = "Merge sketches saved by -o instead of reading input; may be repeated" )
 __doc__ = "::\n\n\t" + argp.format_help( ).replace( "\n", "\n\t" ) + __doc__
 
 def _main( ):
 	args = argp.parse_args( )
-	adVitals = vitals( csv.reader( sys.stdin, csv.excel_tab ) )
-	csv.writer( sys.stdout, csv.excel_tab ).writerow( adVitals )
+	csvw = csv.writer( sys.stdout, csv.excel_tab )
+	if args.strQuantiles or args.ostmSketches or args.aistmSketches:
+		if args.aistmSketches:
+			apSketches = []
+			for istm in args.aistmSketches:
+				merge_sketches( apSketches, load_sketches( istm ) )
+		else:
+			mmapIn = sfle.mapfile( sys.stdin ) if ( args.iJobs > 1 ) else None
+			apSketches = columns_parallel( mmapIn, args.iJobs, sketches ) if mmapIn else \
+				sketches( csv.reader( sys.stdin, csv.excel_tab ) )
+		if args.ostmSketches:
+			save_sketches( apSketches, args.ostmSketches )
+			args.ostmSketches.close( )
+		adQuantiles = [float(s) for s in ( args.strQuantiles or "0.25,0.5,0.75" ).split( "," )]
+		csvw.writerow( ["column", "count", "distinct"] + ["q%g" % d for d in adQuantiles] )
+		for i in range( len( apSketches ) ):
+			pQuantiles = apSketches[i].m_pQuantiles
+			csvw.writerow( [i, pQuantiles.count( ), apSketches[i].m_pDistinct.count( )] +
+				[pQuantiles.quantile( d ) for d in adQuantiles] )
+		return
+	mmapIn = sfle.mapfile( sys.stdin ) if ( args.iJobs > 1 ) else None
+	if mmapIn:
+		# Without -a only the first column is reported, so workers summarize only it
+		apMoments = columns_parallel( mmapIn, args.iJobs, columns if args.fAll else first_column )
+	elif args.fAll:
+		apMoments = columns( csv.reader( sys.stdin, csv.excel_tab ) )
+	else:
+		csvw.writerow( vitals( csv.reader( sys.stdin, csv.excel_tab ) ) )
+		return
+	if args.fAll:
+		csvw.writerow( ("column", "count", "sum", "mean", "variance", "SD", "min", "max") )
+		for i in range( len( apMoments ) ):
+			iCount, dSum, dMean, dVar, dMin, dMax = apMoments[i].get( )
+			csvw.writerow( (i, iCount, dSum, dMean, dVar, apMoments[i].sd( ), dMin, dMax) )
+	else:
+		csvw.writerow( _vitals( apMoments[0] if apMoments else CMoments( ) ) )
 
 if __name__ == "__main__":
 	_main( )